@@ -19,29 +19,45 @@
 
 import os
 import re
+import io
+import codecs
+import sys
+import time
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
-from libs import save_duplicate_to_excel, save_duplicate_and_update_xlsx, parse_hex_string, split_long_lines
+from openpyxl import load_workbook
+from libs import save_duplicate_rows_to_excel, save_duplicate_and_update_xlsx, find_duplicate_rows, parse_hex_string, split_long_lines, detect_encoding, throttle_progress
+from libs import LineSplitter
+from libs import save_usage_to_excel, save_overflow_to_excel, atomic_write
+from matcher import AhoCorasick, LayeredAutomaton
+from instrument import StageRecorder, NULL_RECORDER
+from dict_cache import cache_key, get_cached_matcher, store_cached_matcher, dump_compiled, load_compiled_buffer
+from config import STREAM_MEMORY_LIMIT, STREAM_MIN_FILE_SIZE, READ_BLOCK_SIZE, WRITE_CHUNK_SIZE
+from config import PARALLEL_WORKERS, PARALLEL_MIN_SIZE, STAGE_LOG_FILE, STAGE_TRACE_MEMORY, MATCH_FOLD, REGEX_RULE_PREFIX
+from config import MATCH_WHOLE_WORD
+from config import SPLIT_WIDTH, DICT_CACHE_ZERO_COPY_MIN_ENTRIES
 
 def load_dictionary_txt(dict_file, encoding, show_popup=None):
     translation_dict = {}
-    duplicate_info = []
-    line_number_map = {}
+    # Giữ các cột (dòng, khóa, giá trị) để phân tích trùng một lần ở cuối nếu cần
+    lines = []
+    srcs = []
+    tgts = []
     with open(dict_file, 'r', encoding=encoding) as f:
         for i, line in enumerate(f, 1):
             if '=' in line:
                 src, tgt = line.strip().split('=', 1)
                 src = src.strip()
                 tgt = tgt.strip()
-                if src in translation_dict:
-                    duplicate_info.append((i, src, tgt))
-                    if src in line_number_map:
-                        prev_line = line_number_map[src]
-                        duplicate_info.append((prev_line, src, translation_dict[src]))
                 translation_dict[src] = tgt
-                if src not in line_number_map:
-                    line_number_map[src] = i
-    if duplicate_info:
-        group_count = save_duplicate_to_excel(duplicate_info, "Duplicate.xlsx")
+                lines.append(i)
+                srcs.append(src)
+                tgts.append(tgt)
+    if len(translation_dict) < len(srcs):
+        duplicate_rows = find_duplicate_rows(lines, srcs, tgts)
+        group_count = save_duplicate_rows_to_excel(duplicate_rows, "Duplicate.xlsx")
         if show_popup:
             show_popup(
                 f"Phát hiện dòng trùng trong từ điển {os.path.basename(dict_file)}",
@@ -53,25 +69,50 @@ def load_dictionary_txt(dict_file, encoding, show_popup=None):
         raise Exception("DUPLICATE_DETECTED")
     return translation_dict
 
+# Đọc hai cột đầu của sheet ở chế độ read_only, bỏ dòng tiêu đề.
+# Trả về (số dòng Excel, nguồn, đích) với giá trị được chuyển thành chuỗi giống pd.read_excel(dtype=str):
+# ô trống -> 'nan', số nguyên lưu dạng float -> '5'; các dòng trống ở cuối sheet bị bỏ qua.
+def iter_excel_pairs(excel_file, sheet_name=0):
+    wb = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet_name] if isinstance(sheet_name, int) else wb[sheet_name]
+        ws.reset_dimensions()
+        blank_lines = []
+        for excel_line, row in enumerate(ws.iter_rows(min_row=2, max_col=2, values_only=True), 2):
+            src = row[0] if len(row) > 0 else None
+            tgt = row[1] if len(row) > 1 else None
+            if src is None and tgt is None:
+                blank_lines.append(excel_line)
+                continue
+            for blank_line in blank_lines:
+                yield blank_line, 'nan', 'nan'
+            blank_lines = []
+            yield excel_line, _excel_str(src), _excel_str(tgt)
+    finally:
+        wb.close()
+
+def _excel_str(value):
+    if value is None:
+        return 'nan'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
 def load_dictionary_excel(excel_file, sheet_name=0, show_popup=None):
-    df = pd.read_excel(excel_file, sheet_name=sheet_name, dtype=str)
     translation_dict = {}
-    duplicate_info = []
-    line_number_map = {}
-    for idx, row in df.iterrows():
-        src = str(row[0]).strip()
-        tgt = str(row[1]).strip()
-        excel_line = idx + 2
-        if src in translation_dict:
-            duplicate_info.append((excel_line, src, tgt))
-            if src in line_number_map:
-                prev_line = line_number_map[src]
-                duplicate_info.append((prev_line, src, translation_dict[src]))
+    lines = []
+    srcs = []
+    tgts = []
+    for excel_line, src, tgt in iter_excel_pairs(excel_file, sheet_name):
+        src = src.strip()
+        tgt = tgt.strip()
         translation_dict[src] = tgt
-        if src not in line_number_map:
-            line_number_map[src] = excel_line
-    if duplicate_info:
-        group_count = save_duplicate_and_update_xlsx(duplicate_info, excel_file, "Duplicate.xlsx")
+        lines.append(excel_line)
+        srcs.append(src)
+        tgts.append(tgt)
+    if len(translation_dict) < len(srcs):
+        duplicate_rows = find_duplicate_rows(lines, srcs, tgts)
+        group_count = save_duplicate_and_update_xlsx(duplicate_rows, excel_file, "Duplicate.xlsx")
         if show_popup:
             show_popup(
                 f"Phát hiện dòng trùng trong từ điển {os.path.basename(excel_file)}",
@@ -83,6 +124,157 @@ def load_dictionary_excel(excel_file, sheet_name=0, show_popup=None):
         raise Exception("DUPLICATE_DETECTED")
     return translation_dict
 
+# Nạp một hoặc nhiều từ điển xếp chồng (gốc trước, lớp đè sau; lớp sau thắng khi trùng khóa).
+# Mỗi từ điển được biên dịch và cache riêng, nên đổi lớp đè không phải dựng lại từ điển gốc.
+def load_dictionary_stack(dict_files, show_popup=None, use_cache=True, recorder=NULL_RECORDER, fold=None,
+                          whole_word=False):
+    if isinstance(dict_files, str):
+        dict_files = [dict_files]
+    layers = []
+    for dict_file in dict_files:
+        with recorder.stage("dictionary_layer", os.path.getsize(dict_file), file=dict_file):
+            layers.append(load_dictionary_matcher(dict_file, show_popup, use_cache, recorder, fold, whole_word))
+    if len(layers) == 1:
+        return layers[0]
+    return LayeredAutomaton(layers)
+
+# Nạp từ điển dưới dạng automaton đã biên dịch, ưu tiên lấy từ cache trên đĩa
+def load_dictionary_matcher(dict_file_path, show_popup=None, use_cache=True, recorder=NULL_RECORDER, fold=None,
+                            whole_word=False):
+    options = {
+        "loader": os.path.splitext(dict_file_path)[1].lower(), "fold": fold, "rule_prefix": REGEX_RULE_PREFIX,
+        "whole_word": whole_word,
+    }
+    dict_size = os.path.getsize(dict_file_path)
+    if use_cache:
+        with recorder.stage("dictionary_cache", dict_size) as record:
+            key = cache_key(dict_file_path, options)
+            automaton = get_cached_matcher(key)
+            record["hit"] = automaton is not None
+        if automaton is not None:
+            return automaton
+    else:
+        key = None
+    with recorder.stage("dictionary_load", dict_size) as record:
+        if dict_file_path.lower().endswith('.xlsx'):
+            translation_dict = load_dictionary_excel(dict_file_path, show_popup=show_popup)
+        else:
+            with recorder.stage("detect_encoding", dict_size, file="dictionary"):
+                dict_encoding = detect_encoding(dict_file_path)[0] or 'utf-8'
+            translation_dict = load_dictionary_txt(dict_file_path, dict_encoding, show_popup=show_popup)
+        record["entries"] = len(translation_dict)
+    with recorder.stage("matcher_build", dict_size, entries=len(translation_dict)):
+        automaton = AhoCorasick(translation_dict, fold, REGEX_RULE_PREFIX, whole_word)
+    if key:
+        with recorder.stage("dictionary_cache_store", dict_size):
+            store_cached_matcher(key, automaton)
+        # Từ điển rất lớn thì đổi sang bản dùng thẳng tệp cache qua mmap để giải phóng các đối tượng Python vừa dựng;
+        # còn lại giữ automaton vừa dựng vì duyệt trên list nhanh hơn
+        if len(translation_dict) >= DICT_CACHE_ZERO_COPY_MIN_ENTRIES:
+            automaton = get_cached_matcher(key) or automaton
+    return automaton
+
+# Chỉ mục các khoảng [start, end] đã nhận khi kiểm tra chồng lấn bản vá.
+# ranges: mọi khoảng sẽ được xét (theo thứ tự dòng), mỗi khoảng có một ô cố định theo thứ tự start;
+# cây phân đoạn trên các ô giữ thứ tự nhận nhỏ nhất và end lớn nhất, nên mỗi lần tìm/thêm là O(log n).
+# Các khoảng đã nhận (end >= start) không chồng nhau, nên khoảng chồng lên [start, end] gồm các khoảng
+# có start nằm trong [start, end] cộng với khoảng đứng ngay trước (chỉ có thể là khoảng có end lớn nhất).
+# Khoảng ngược (end < start, khi số byte ghi <= 0) hiếm gặp nên được giữ riêng và so tuần tự.
+class _AcceptedRanges:
+    def __init__(self, ranges):
+        order = sorted(range(len(ranges)), key=lambda i: (ranges[i][0], i))
+        self.ranges = ranges
+        self.starts = [ranges[i][0] for i in order]
+        self.slot = [0] * len(ranges)
+        for k, i in enumerate(order):
+            self.slot[i] = k
+        size = 1
+        while size < len(ranges):
+            size *= 2
+        self.size = size
+        # first: thứ tự dòng nhỏ nhất đã nhận trong đoạn; reach/reach_end: dòng đã nhận có end lớn nhất và end đó
+        self.first = [len(ranges)] * (2 * size)
+        self.reach = [-1] * (2 * size)
+        self.reach_end = [float('-inf')] * (2 * size)
+        self.reversed = []
+
+    def add(self, pos):
+        ranges = self.ranges
+        start, end = ranges[pos]
+        if end < start:
+            self.reversed.append(pos)
+            return
+        first = self.first
+        reach = self.reach
+        reach_end = self.reach_end
+        k = self.slot[pos] + self.size
+        first[k] = pos
+        reach[k] = pos
+        reach_end[k] = end
+        k //= 2
+        # Đi lên gốc; dừng khi nút cha không đổi (khi đó các nút trên cũng không đổi)
+        while k:
+            changed = False
+            if pos < first[k]:
+                first[k] = pos
+                changed = True
+            if end > reach_end[k]:
+                reach_end[k] = end
+                reach[k] = pos
+                changed = True
+            if not changed:
+                break
+            k //= 2
+
+    # Dòng nhận sớm nhất chồng lên [start, end] (cùng điều kiện với cách so từng khoảng), -1 nếu không có
+    def find(self, start, end):
+        ranges = self.ranges
+        first = self.first
+        best = len(ranges)
+        # Các khoảng đã nhận có start nằm trong [start, end]
+        left = bisect_left(self.starts, start) + self.size
+        lo = left
+        hi = bisect_right(self.starts, end) + self.size
+        while lo < hi:
+            if lo & 1:
+                if first[lo] < best:
+                    best = first[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if first[hi] < best:
+                    best = first[hi]
+            lo //= 2
+            hi //= 2
+        # Khoảng đã nhận bắt đầu trước start: chỉ khoảng có end lớn nhất mới có thể vươn tới start
+        reach = self.reach
+        reach_end = self.reach_end
+        cand = -1
+        cand_end = start - 1
+        lo = self.size
+        hi = left
+        while lo < hi:
+            if lo & 1:
+                if reach_end[lo] > cand_end:
+                    cand_end = reach_end[lo]
+                    cand = reach[lo]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                if reach_end[hi] > cand_end:
+                    cand_end = reach_end[hi]
+                    cand = reach[hi]
+            lo //= 2
+            hi //= 2
+        if 0 <= cand < best and ranges[cand][0] <= end:
+            best = cand
+        for pos in self.reversed:
+            if pos < best:
+                s, e = ranges[pos]
+                if not (end < s or start > e):
+                    best = pos
+        return best if best < len(ranges) else -1
+
 def load_patch_data_xlsx(file_path, show_popup=None):
     df = pd.read_excel(file_path, dtype=str)
     columns = list(df.columns)
@@ -91,55 +283,44 @@ def load_patch_data_xlsx(file_path, show_popup=None):
             show_popup("Thiếu cột C", "File patch_data.xlsx phải có 3 cột: Offset, Value, Số bytes ghi (C).")
         raise Exception("Thiếu cột C")
     patch_list = []
-    valid_indices = []
-    written_ranges = []
+    valid_indices = set()
     group_dict = {}
     overlap_groups = []
     overlap_pairs = []
-    for idx, row in df.iterrows():
-        offset = row[0]
-        value = row[1]
-        byte_len = row[2] if len(row) > 2 else ""
+    # Duyệt các dòng một lần: nhóm theo (offset, số byte) và giữ lại các dòng đọc được để xét chồng lấn
+    rows = []
+    for idx, *values in df.itertuples(name=None):
+        offset, value, byte_len = values[0], values[1], values[2]
         if not offset or not value or not byte_len:
             continue
         try:
             offset_int = int(offset, 0)
             byte_len_int = int(byte_len)
-            assert byte_len_int > 0
         except Exception:
             continue
-        group_key = (offset_int, byte_len_int)
-        group_dict.setdefault(group_key, []).append( (idx, row) )
+        row = dict(zip(columns, values))
+        if byte_len_int > 0:
+            group_dict.setdefault((offset_int, byte_len_int), []).append((idx, row))
+        rows.append((idx, row, value, offset_int, byte_len_int))
     grouped_trung_offset_idx = set()
     for grp in group_dict.values():
         if len(grp) >= 2:
             overlap_groups.append(grp)
             for idx, _ in grp:
                 grouped_trung_offset_idx.add(idx)
-    for idx, row in df.iterrows():
-        if idx in grouped_trung_offset_idx:
-            continue
-        offset = row[0]
-        value = row[1]
-        byte_len = row[2] if len(row) > 2 else ""
-        if not offset or not value or not byte_len:
-            continue
-        try:
-            offset_int = int(offset, 0)
-            byte_len_int = int(byte_len)
-        except Exception:
-            continue
+    rows = [r for r in rows if r[0] not in grouped_trung_offset_idx]
+    # Dòng được nhận theo thứ tự, nên khoảng nhận sớm nhất chồng lên dòng hiện tại cũng là khoảng
+    # mà cách so lần lượt với các khoảng đã ghi sẽ gặp đầu tiên
+    written_ranges = _AcceptedRanges([(o, o + n - 1) for _, _, _, o, n in rows])
+    for pos, (idx, row, value, offset_int, byte_len_int) in enumerate(rows):
         start = offset_int
         end = offset_int + byte_len_int - 1
-        overlap_found = False
-        for s, e, idx_gay, row_gay in written_ranges:
-            if not (end < s or start > e):
-                overlap_pairs.append((
-                    dict(row_gay), dict(row), idx_gay, idx, "Gây chồng lấn"
-                ))
-                overlap_found = True
-                break
-        if overlap_found:
+        gay = written_ranges.find(start, end)
+        if gay >= 0:
+            idx_gay, row_gay = rows[gay][0], rows[gay][1]
+            overlap_pairs.append((
+                dict(row_gay), dict(row), idx_gay, idx, "Gây chồng lấn"
+            ))
             continue
         value_bytes = parse_hex_string(value)
         if len(value_bytes) > byte_len_int:
@@ -154,8 +335,8 @@ def load_patch_data_xlsx(file_path, show_popup=None):
         if len(value_bytes) < byte_len_int:
             value_bytes = value_bytes + b"\x00" * (byte_len_int - len(value_bytes))
         patch_list.append((offset_int, value_bytes))
-        valid_indices.append(idx)
-        written_ranges.append((start, end, idx, row))
+        valid_indices.add(idx)
+        written_ranges.add(pos)
     if overlap_groups or overlap_pairs:
         overlap_rows = []
         for group in overlap_groups:
@@ -205,87 +386,402 @@ def load_patch_data_xlsx(file_path, show_popup=None):
             show_popup("Lỗi dữ liệu patch", msg)
     return patch_list
 
-def replacing_progress(content, translation_dict, progress_callback, auto_split=False, split_limit=80, append_vars=None):
-    from flashtext import KeywordProcessor
-    keys = sorted(translation_dict, key=len, reverse=True)
+def replacing_progress(content, translation_dict, progress_callback, auto_split=False, split_limit=80, append_vars=None,
+                       replacer=None, recorder=NULL_RECORDER, split_width=SPLIT_WIDTH):
+    if isinstance(translation_dict, (AhoCorasick, LayeredAutomaton)):
+        automaton = translation_dict
+    else:
+        automaton = AhoCorasick(translation_dict)
+    if replacer is None:
+        replacer = automaton.replacer()
+    # Đầu ra của bộ thay thế đi thẳng vào bộ tách dòng, dòng vắt qua ranh giới chunk vẫn được tách đúng
+    splitter = LineSplitter(split_limit, append_vars, split_width) if auto_split else None
+    total_len = len(content)
+    chunk_size = 256 * 1024
+    result_chunks = []
+    for i in range(0, total_len, chunk_size):
+        replaced_chunk = replacer.feed(content[i:i+chunk_size])
+        if splitter is not None:
+            replaced_chunk = _split_timed(splitter, replaced_chunk, recorder)
+        result_chunks.append(replaced_chunk)
+        percent = min(100, (i + chunk_size) / total_len * 100)
+        progress_callback(percent)
+    replaced_chunk = replacer.flush()
+    if splitter is not None:
+        replaced_chunk = _split_timed(splitter, replaced_chunk, recorder, final=True)
+        recorder.finish("split")
+    result_chunks.append(replaced_chunk)
+    progress_callback(100)
+    return ''.join(result_chunks)
+
+# Đưa một đoạn qua bộ tách dòng và cộng dồn thời gian vào bước "split" (nằm bên trong bước thay thế)
+def _split_timed(splitter, text, recorder, parent="replace", final=False):
+    if not recorder.enabled:
+        return splitter.feed(text) + splitter.flush() if final else splitter.feed(text)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = splitter.feed(text) + splitter.flush() if final else splitter.feed(text)
+    recorder.add("split", time.perf_counter() - start, time.process_time() - cpu_start, len(text), parent=parent)
+    return result
+
+# Automaton dùng trong tiến trình con: kế thừa qua fork, hoặc nạp một lần qua initializer
+_worker_automaton = None
+
+def _init_replace_worker(blob):
+    global _worker_automaton
+    if isinstance(blob, list):
+        _worker_automaton = LayeredAutomaton([load_compiled_buffer(b) for b in blob])
+    elif blob is not None:
+        _worker_automaton = load_compiled_buffer(blob)
+
+def _replace_segment(args):
+    segment, auto_split, split_limit, append_vars, split_width, collect_stats = args
+    replacer = _worker_automaton.replacer(collect_stats)
+    replaced = replacer.feed(segment) + replacer.flush()
+    if auto_split:
+        replaced = split_long_lines(replaced, split_limit, append_vars, split_width)
+    return replaced, replacer.hits, replacer.sparse_stats()
+
+# Chia văn bản thành khoảng count đoạn, mỗi điểm cắt nằm ngay sau một ký tự xuống dòng
+def split_at_line_boundaries(content, count):
+    total_len = len(content)
+    step = max(1, total_len // max(1, count))
+    segments = []
+    start = 0
+    while start < total_len:
+        cut = content.find('\n', start + step)
+        end = total_len if cut < 0 else cut + 1
+        segments.append(content[start:end])
+        start = end
+    return segments
+
+def resolve_workers(workers=None):
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+# Tạo process pool mà mỗi tiến trình con đều có sẵn automaton.
+# Chỉ dùng fork trên Linux; macOS (fork không an toàn khi tiến trình đã có luồng, vd. giao diện Tk) và Windows
+# dùng spawn, khi đó automaton được gửi sang tiến trình con dưới dạng bản biên dịch nhị phân.
+def create_replace_pool(automaton, workers):
+    global _worker_automaton
+    if sys.platform.startswith('linux'):
+        ctx = multiprocessing.get_context('fork')
+        blob = None
+        _worker_automaton = automaton
+    else:
+        ctx = multiprocessing.get_context('spawn')
+        if isinstance(automaton, LayeredAutomaton):
+            blob = [dump_compiled(layer) for layer in automaton.layers]
+        else:
+            blob = dump_compiled(automaton)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                               initializer=_init_replace_worker, initargs=(blob,))
+
+# Thay thế song song trên nhiều tiến trình, kết quả giống hệt replacing_progress
+def parallel_replacing_progress(content, automaton, progress_callback, workers=None,
+                                auto_split=False, split_limit=80, append_vars=None, replacer=None,
+                                recorder=NULL_RECORDER, split_width=SPLIT_WIDTH):
+    global _worker_automaton
+    if not isinstance(automaton, (AhoCorasick, LayeredAutomaton)):
+        automaton = AhoCorasick(automaton)
+    workers = resolve_workers(workers)
+    # Khóa chứa xuống dòng hoặc luật regex có thể vắt qua điểm cắt -> chạy tuần tự
+    if workers <= 1 or automaton.rule_count or automaton.keys_contain('\n'):
+        return replacing_progress(content, automaton, progress_callback, auto_split, split_limit, append_vars,
+                                  replacer, recorder, split_width)
+    collect_stats = replacer is not None and replacer.counts is not None
+    segments = split_at_line_boundaries(content, workers * 4)
+    offsets = []
+    pos = 0
+    for segment in segments:
+        offsets.append(pos)
+        pos += len(segment)
+    results = [None] * len(segments)
     try:
-        keyword_processor = KeywordProcessor()
-        for k in keys:
-            v = translation_dict[k]
-            if k:
-                keyword_processor.add_keyword(k, v)
-        total_len = len(content)
-        chunk_size = 256 * 1024
-        result_chunks = []
-        for i in range(0, total_len, chunk_size):
-            chunk = content[i:i+chunk_size]
-            replaced_chunk = keyword_processor.replace_keywords(chunk)
-            if auto_split:
-                replaced_chunk = split_long_lines(replaced_chunk, split_limit, append_vars)
-            result_chunks.append(replaced_chunk)
-            percent = min(100, (i + chunk_size) / total_len * 100)
-            progress_callback(percent)
-        progress_callback(100)
-        return ''.join(result_chunks)
-    except Exception as e:
-        import re
-        pattern = re.compile('|'.join(re.escape(k) for k in keys))
-        total_len = len(content)
-        chunk_size = 256 * 1024
-        result_chunks = []
-        for i in range(0, total_len, chunk_size):
-            chunk = content[i:i+chunk_size]
-            replaced_chunk = pattern.sub(lambda m: translation_dict[m.group(0)], chunk)
-            if auto_split:
-                replaced_chunk = split_long_lines(replaced_chunk, split_limit, append_vars)
-            result_chunks.append(replaced_chunk)
-            percent = min(100, (i + chunk_size) / total_len * 100)
-            progress_callback(percent)
-        progress_callback(100)
-        return ''.join(result_chunks)
+        with create_replace_pool(automaton, workers) as executor:
+            futures = {
+                executor.submit(
+                    _replace_segment, (segment, auto_split, split_limit, append_vars, split_width, collect_stats)
+                ): idx
+                for idx, segment in enumerate(segments)
+            }
+            done = 0
+            for future in as_completed(futures):
+                idx = futures[future]
+                results[idx], hits, stats = future.result()
+                if replacer is not None:
+                    replacer.merge_stats(stats, offsets[idx], hits)
+                done += 1
+                progress_callback(done / len(segments) * 100)
+    finally:
+        _worker_automaton = None
+    progress_callback(100)
+    return ''.join(results)
 
-def reading_progress(original_file, input_encoding, progress_callback):
+def reading_progress(original_file, input_encoding, progress_callback, block_size=READ_BLOCK_SIZE):
+    # Đọc byte thô theo khối lớn vào bộ đệm cấp sẵn, tiến trình tính theo offset trong tệp
     file_size = os.path.getsize(original_file)
+    buf = bytearray(file_size)
     read_size = 0
-    content = ""
-    with open(original_file, 'r', encoding=input_encoding, errors='replace') as f_in:
-        while True:
-            chunk = f_in.read(8 * 1024)
-            if not chunk:
+    with open(original_file, 'rb') as f_in, memoryview(buf) as view:
+        while read_size < file_size:
+            n = f_in.readinto(view[read_size:read_size + block_size])
+            if not n:
                 break
-            content += chunk
-            read_size += len(chunk.encode(input_encoding, errors='ignore'))
-            percent = min(100, read_size / file_size * 100) if file_size > 0 else 100
-            progress_callback(percent)
+            read_size += n
+            progress_callback(min(100, read_size / file_size * 100))
+    if read_size < file_size:
+        del buf[read_size:]
+    # Giải mã một lần, rồi chuẩn hóa xuống dòng giống chế độ đọc văn bản
+    content = buf.decode(input_encoding, errors='replace')
+    del buf
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
     progress_callback(100)
     return content
 
-def saving_progress(output_file, content, progress_callback):
+def saving_progress(output_file, content, progress_callback, atomic=False, chunk_size=WRITE_CHUNK_SIZE):
+    # Ghi theo khối lớn, không flush từng khối; tiến trình được giới hạn theo thời gian
     total = len(content)
-    chunk_size = 8 * 1024
-    written = 0
-    SIMULATE_DELAY = False
-    SMALL_FILE_SIZE = 20 * 1024 * 1024
-    if total <= SMALL_FILE_SIZE:
-        SIMULATE_DELAY = True
-    with open(output_file, 'w', encoding='utf-8') as f_out:
+    report = throttle_progress(progress_callback)
+    with atomic_write(output_file, 'w', encoding='utf-8', atomic=atomic) as f_out:
         for i in range(0, total, chunk_size):
-            chunk = content[i:i + chunk_size]
-            f_out.write(chunk)
-            f_out.flush()
-            written += len(chunk)
-            percent = min(100, written / total * 100)
+            f_out.write(content[i:i + chunk_size])
+            report(min(100, (i + chunk_size) / total * 100))
+    progress_callback(100)
+
+# Đọc -> thay thế -> tách dòng -> ghi theo luồng, bộ nhớ bị chặn bởi memory_limit
+def streaming_progress(original_file, output_file, input_encoding, automaton, progress_callback,
+                       auto_split=False, split_limit=80, append_vars=None, memory_limit=STREAM_MEMORY_LIMIT,
+                       replacer=None, recorder=NULL_RECORDER, split_width=SPLIT_WIDTH):
+    # Mỗi khối byte có thể nở thành chuỗi đã giải mã, chuỗi đã thay thế và bản đã tách dòng
+    block_size = max(64 * 1024, memory_limit // 8)
+    file_size = os.path.getsize(original_file)
+    decoder = codecs.getincrementaldecoder(input_encoding)(errors='replace')
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    if replacer is None:
+        replacer = automaton.replacer()
+    splitter = LineSplitter(split_limit, append_vars, split_width) if auto_split else None
+    read_size = 0
+    # Thời điểm đo giữa các bước con (chỉ dùng khi có recorder)
+    timed = recorder.enabled
+    clock = time.perf_counter
+    cpu_clock = time.process_time
+    with open(original_file, 'rb') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
+        while True:
+            if timed:
+                t0, c0 = clock(), cpu_clock()
+            block = f_in.read(block_size)
+            final = not block
+            text = decoder.decode(block, final=final)
+            if timed:
+                t1, c1 = clock(), cpu_clock()
+                recorder.add("read", t1 - t0, c1 - c0, len(block), parent="stream")
+            replaced = replacer.feed(text)
+            if final:
+                replaced += replacer.flush()
+            if timed:
+                t2, c2 = clock(), cpu_clock()
+                recorder.add("replace", t2 - t1, c2 - c1, len(text), parent="stream")
+            if splitter is not None:
+                replaced = _split_timed(splitter, replaced, recorder, "stream", final)
+            if timed:
+                t3, c3 = clock(), cpu_clock()
+            f_out.write(replaced)
+            if timed:
+                recorder.add("write", clock() - t3, cpu_clock() - c3, len(replaced), parent="stream")
+            if final:
+                break
+            read_size += len(block)
+            percent = min(100, read_size / file_size * 100) if file_size > 0 else 100
             progress_callback(percent)
-            if SIMULATE_DELAY:
-                import time
-                time.sleep(0.01)
+    for name in ("read", "replace", "split", "write"):
+        recorder.finish(name)
     progress_callback(100)
+    return replacer.hits
+
+# Dịch trọn một tệp theo luồng (dùng cho chế độ chạy hàng loạt), trả về thống kê của tệp
+def translate_file(input_file, output_file, automaton, input_encoding=None,
+                   auto_split=False, split_limit=80, append_vars=None, track_keys=False, split_width=SPLIT_WIDTH):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    if not input_encoding:
+        input_encoding = detect_encoding(input_file)[0] or 'utf-8'
+    replacer = automaton.replacer(track_keys)
+    hits = streaming_progress(
+        input_file, output_file, input_encoding, automaton, lambda percent: None,
+        auto_split, split_limit, append_vars, replacer=replacer, split_width=split_width
+    )
+    stats = {
+        "input": input_file,
+        "output": output_file,
+        "encoding": input_encoding,
+        "bytes_in": os.path.getsize(input_file),
+        "bytes_out": os.path.getsize(output_file),
+        "hits": hits,
+        "seconds": time.perf_counter() - start,
+        "cpu_seconds": time.process_time() - cpu_start,
+    }
+    if track_keys:
+        stats["keys"] = replacer.matched_keys()
+    return stats
+
+def translate_file_task(args):
+    input_file, output_file, input_encoding, auto_split, split_limit, append_vars, track_keys, split_width = args
+    return translate_file(input_file, output_file, _worker_automaton, input_encoding,
+                          auto_split, split_limit, append_vars, track_keys, split_width)
+
+# Nạp một hoặc nhiều từ điển thành một dict (lớp sau thắng khi trùng khóa), không biên dịch
+def load_dictionary_pairs(dict_files, show_popup=None):
+    if isinstance(dict_files, str):
+        dict_files = [dict_files]
+    translation_dict = {}
+    for dict_file in dict_files:
+        if dict_file.lower().endswith('.xlsx'):
+            translation_dict.update(load_dictionary_excel(dict_file, show_popup=show_popup))
+        else:
+            dict_encoding = detect_encoding(dict_file)[0] or 'utf-8'
+            translation_dict.update(load_dictionary_txt(dict_file, dict_encoding, show_popup=show_popup))
+    return translation_dict
+
+# Mã hóa chuỗi cho chế độ nhị phân, bỏ BOM mà một số encoding (utf-16, utf-8-sig...) tự thêm vào đầu
+def _encode_binary(text, encoding):
+    data = text.encode(encoding)
+    bom = "".encode(encoding)
+    return data[len(bom):] if bom and data.startswith(bom) else data
+
+# Dựng automaton thay chuỗi trong tệp nhị phân: khóa/giá trị được mã hóa bằng encoding rồi giải mã latin-1,
+# để mỗi byte ứng với đúng một ký tự và automaton chuỗi quét được trực tiếp trên byte.
+# Giá trị ngắn hơn khóa được đệm b"\x00" cho đủ độ dài; giá trị dài hơn không được thay mà giữ nguyên khóa
+# (vẫn khớp để đếm số lần gặp). Trả về (automaton, rejected, errors): rejected[chỉ số khóa] là thông tin
+# các khóa không thay được, errors là các dòng báo cáo cho khóa không mã hóa được hoặc là luật regex.
+def build_binary_matcher(translation_dict, encoding):
+    pairs = {}
+    rejected = {}
+    errors = []
+    for key, value in translation_dict.items():
+        if not key:
+            continue
+        if REGEX_RULE_PREFIX and key.startswith(REGEX_RULE_PREFIX):
+            errors.append(_overflow_row(key, value, None, None, "Luật regex không dùng được ở chế độ nhị phân"))
+            continue
+        try:
+            key_bytes = _encode_binary(key, encoding)
+            value_bytes = _encode_binary(value, encoding)
+        except UnicodeEncodeError:
+            errors.append(_overflow_row(key, value, None, None, f"Không mã hóa được bằng {encoding}"))
+            continue
+        if not key_bytes:
+            continue
+        latin_key = key_bytes.decode('latin-1')
+        if len(value_bytes) > len(key_bytes):
+            pairs[latin_key] = latin_key
+            rejected[latin_key] = (key, value, len(key_bytes), len(value_bytes), "Giá trị dài hơn khóa")
+        else:
+            pairs[latin_key] = (value_bytes + b"\x00" * (len(key_bytes) - len(value_bytes))).decode('latin-1')
+            rejected.pop(latin_key, None)
+    automaton = AhoCorasick(pairs)
+    index = {k: i for i, k in enumerate(automaton.keys)}
+    return automaton, {index[k]: info for k, info in rejected.items()}, errors
+
+def _overflow_row(key, value, key_len, value_len, reason, count="", first=""):
+    return {
+        "Từ khóa": key, "Giá trị": value, "Byte khóa": key_len if key_len is not None else "",
+        "Byte giá trị": value_len if value_len is not None else "", "Số lần gặp": count,
+        "Offset đầu tiên": first, "Lý do": reason,
+    }
+
+# Thay chuỗi trong tệp nhị phân theo luồng: đọc từng khối, quét bằng automaton của build_binary_matcher
+# và ghi ra output_file; độ dài tệp không đổi. Trả về replacer (có thống kê theo khóa).
+def binary_replace_file(input_file, output_file, automaton, progress_callback=None, block_size=READ_BLOCK_SIZE):
+    replacer = automaton.replacer(True)
+    file_size = os.path.getsize(input_file)
+    read_size = 0
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        while True:
+            block = f_in.read(block_size)
+            if not block:
+                f_out.write(replacer.flush().encode('latin-1'))
+                break
+            f_out.write(replacer.feed(block.decode('latin-1')).encode('latin-1'))
+            read_size += len(block)
+            if progress_callback:
+                progress_callback(min(100, read_size / file_size * 100))
+    if progress_callback:
+        progress_callback(100)
+    return replacer
+
+# Thay chuỗi theo từ điển trực tiếp trong tệp nhị phân (một lượt quét), kết quả ghi ra <tên>_patched<đuôi>.
+# Các khóa gặp trong tệp nhưng không thay được (giá trị dài hơn khóa) và các khóa không mã hóa được
+# được ghi vào report_file. Trả về thống kê của tệp.
+def process_binary_replace(input_file, dict_files, encoding, progress_callback=None, show_popup=None,
+                           output_file=None, report_file="Overflow.xlsx", binary_matcher=None):
+    start = time.perf_counter()
+    if output_file is None:
+        base_name, ext = os.path.splitext(input_file)
+        output_file = f"{base_name}_patched{ext}"
+    if binary_matcher is None:
+        binary_matcher = build_binary_matcher(load_dictionary_pairs(dict_files, show_popup), encoding)
+    matcher, rejected, errors = binary_matcher
+    replacer = binary_replace_file(input_file, output_file, matcher, progress_callback)
+    counts = replacer.counts
+    overflow = [
+        _overflow_row(key, value, key_len, value_len, reason, counts[k], replacer.first[k])
+        for k, (key, value, key_len, value_len, reason) in sorted(rejected.items()) if counts[k]
+    ]
+    report = overflow + errors
+    if report:
+        save_overflow_to_excel(report, report_file)
+        if show_popup:
+            show_popup(
+                "Có chuỗi không thay được",
+                f"{len(overflow)} khóa có giá trị dài hơn khóa (không thay) và {len(errors)} khóa không dùng được.\n"
+                f"Chi tiết đã được lưu vào {report_file}."
+            )
+    return {
+        "input": input_file,
+        "output": output_file,
+        "encoding": encoding,
+        "bytes_in": os.path.getsize(input_file),
+        "bytes_out": os.path.getsize(output_file),
+        "hits": replacer.hits - sum(counts[k] for k in rejected),
+        "overflow": len(overflow),
+        "unusable": len(errors),
+        "seconds": time.perf_counter() - start,
+    }
+
+def binary_replace_task(args):
+    input_file, output_file, encoding, rejected, errors, report_file = args
+    return process_binary_replace(input_file, None, encoding, output_file=output_file, report_file=report_file,
+                                  binary_matcher=(_worker_automaton, rejected, errors))
+
+# Xuất báo cáo sử dụng từ điển (số lần khớp, vị trí đầu tiên, các khóa chưa từng khớp)
+def report_dictionary_usage(automaton, replacer, show_popup=None, file_path="Usage.xlsx"):
+    used, unused = save_usage_to_excel(automaton.keys, automaton.values, replacer.counts, replacer.first, file_path)
+    if show_popup:
+        show_popup(
+            "Báo cáo sử dụng từ điển",
+            f"{used}/{used + unused} khóa đã được dùng, {unused} khóa chưa từng khớp.\n"
+            f"Chi tiết đã được lưu vào {file_path}."
+        )
+    return used, unused
 
 def process_separated_progress(
     original_file, dict_file_path, update_status, progress_callback,
     status_progress_label, on_save_done, show_popup,
     auto_split, split_limit, input_encoding,
-    append_vars=None, return_content=False):
+    append_vars=None, return_content=False, streaming=None, memory_limit=STREAM_MEMORY_LIMIT,
+    workers=None, usage_report=False, recorder=None, fold=MATCH_FOLD, split_width=SPLIT_WIDTH,
+    whole_word=MATCH_WHOLE_WORD):
+    # Tự tạo recorder khi cấu hình STAGE_LOG_FILE, khi đó cũng tự đóng (ghi log JSON) ở cuối
+    own_recorder = recorder is None and bool(STAGE_LOG_FILE)
+    if own_recorder:
+        recorder = StageRecorder(trace_memory=STAGE_TRACE_MEMORY, log_path=STAGE_LOG_FILE)
+    elif recorder is None:
+        recorder = NULL_RECORDER
     try:
         if dict_file_path is None:
             if show_popup:
@@ -297,32 +793,70 @@ def process_separated_progress(
             status_progress_label("Chờ thao tác...")
             progress_callback(0)
             return None if return_content else None
-        if dict_file_path.lower().endswith('.xlsx'):
-            translation_dict = load_dictionary_excel(dict_file_path, show_popup=show_popup)
-        elif dict_file_path.lower().endswith('.txt'):
-            dict_encoding, _ = detect_encoding(dict_file_path)
-            translation_dict = load_dictionary_txt(dict_file_path, dict_encoding, show_popup=show_popup)
+        # dict_file_path có thể là một tệp hoặc danh sách tệp (từ điển gốc + các lớp đè)
+        dict_files = [dict_file_path] if isinstance(dict_file_path, str) else list(dict_file_path)
+        if dict_files and all(p.lower().endswith(('.xlsx', '.txt')) for p in dict_files):
+            automaton = load_dictionary_stack(
+                dict_files, show_popup=show_popup, recorder=recorder, fold=fold, whole_word=whole_word
+            )
         else:
             if show_popup:
                 show_popup("Lỗi", "Vui lòng chọn dữ liệu định dạng .xlsx hoặc .txt.")
             status_progress_label("Chờ thao tác...")
             progress_callback(0)
             return None if return_content else None
-        status_progress_label("Đang đọc tệp...")
-        progress_callback(0)
-        content = reading_progress(original_file, input_encoding, progress_callback)
-        status_progress_label("Đang thay thế...")
-        progress_callback(0)
-        content = replacing_progress(content, translation_dict, progress_callback, auto_split, split_limit, append_vars)
-        if return_content:
-            progress_callback(100)
-            status_progress_label("Xử lý xong!")
-            return content
-        status_progress_label("Đang lưu tệp...")
-        progress_callback(0)
         base_name = os.path.splitext(original_file)[0]
         output_file = base_name + "_translated.txt"
-        saving_progress(output_file, content, progress_callback)
+        file_size = os.path.getsize(original_file)
+        recorder.info.update({"input": original_file, "dictionary": dict_file_path, "entries": len(automaton)})
+        if not input_encoding:
+            with recorder.stage("detect_encoding", file_size, file="input"):
+                input_encoding = detect_encoding(original_file)[0] or 'utf-8'
+        replacer = automaton.replacer(usage_report)
+        if streaming is None:
+            streaming = file_size >= STREAM_MIN_FILE_SIZE
+        if streaming and not return_content:
+            status_progress_label("Đang xử lý theo luồng...")
+            progress_callback(0)
+            with recorder.stage("stream", file_size):
+                streaming_progress(
+                    original_file, output_file, input_encoding, automaton, progress_callback,
+                    auto_split, split_limit, append_vars, memory_limit, replacer, recorder, split_width
+                )
+        else:
+            status_progress_label("Đang đọc tệp...")
+            progress_callback(0)
+            with recorder.stage("read", file_size):
+                content = reading_progress(original_file, input_encoding, progress_callback)
+            status_progress_label("Đang thay thế...")
+            progress_callback(0)
+            with recorder.stage("replace", len(content)) as record:
+                if len(content) >= PARALLEL_MIN_SIZE and resolve_workers(workers) > 1:
+                    record["workers"] = resolve_workers(workers)
+                    content = parallel_replacing_progress(
+                        content, automaton, progress_callback, workers, auto_split, split_limit, append_vars,
+                        replacer, recorder, split_width
+                    )
+                else:
+                    content = replacing_progress(
+                        content, automaton, progress_callback, auto_split, split_limit, append_vars,
+                        replacer, recorder, split_width
+                    )
+                record["hits"] = replacer.hits
+            if return_content:
+                if usage_report:
+                    report_dictionary_usage(automaton, replacer, show_popup)
+                progress_callback(100)
+                status_progress_label("Xử lý xong!")
+                return content
+            status_progress_label("Đang lưu tệp...")
+            progress_callback(0)
+            with recorder.stage("write") as record:
+                saving_progress(output_file, content, progress_callback)
+                record["bytes"] = os.path.getsize(output_file)
+        if usage_report:
+            with recorder.stage("usage_report", entries=len(automaton)):
+                report_dictionary_usage(automaton, replacer, show_popup)
         status_progress_label("Hoàn thành!")
         if on_save_done:
             on_save_done(output_file)
@@ -335,4 +869,7 @@ def process_separated_progress(
         status_progress_label(f"Lỗi: {str(e)}")
         if show_popup:
             show_popup("Lỗi", str(e))
-        return None if return_content else None 
\ No newline at end of file
+        return None if return_content else None
+    finally:
+        if own_recorder:
+            recorder.close() 
\ No newline at end of file
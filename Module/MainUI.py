@@ -3,12 +3,14 @@
 import os
 import sys
 import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from dependency_checker import check_and_install_dependencies
 from Functions import process_separated_progress, load_patch_data_xlsx
-from libs import resource_path, patch_bytes
+from libs import resource_path, patch_file, plan_patches, throttle_progress
 from config import LABELS, ENCODING_VALUES, ENCODING_LABELS, PRESET_VARS
+from config import SPLIT_WIDTH_VALUES, SPLIT_WIDTH_LABELS, MATCH_WHOLE_WORD
 
 class TextReplacerApp(tk.Tk):
     def __init__(self):
@@ -65,7 +67,7 @@ class TextReplacerApp(tk.Tk):
                 width=12, height=6,
                 command=self.toggle_icon
             )
-        self.icon_button.grid(row=0, column=0, rowspan=7, padx=(8, 5), pady=2, sticky="nw")
+        self.icon_button.grid(row=0, column=0, rowspan=8, padx=(8, 5), pady=2, sticky="nw")
 
         self.data_label = tk.Label(
             frm,
@@ -152,8 +154,16 @@ class TextReplacerApp(tk.Tk):
         self.split_limit_var = tk.StringVar(value="80")
         self.entry_split_limit = tk.Entry(frm, textvariable=self.split_limit_var, width=5, font=("Arial", 10))
         self.entry_split_limit.grid(row=3, column=2, padx=(200, 0), sticky="w")
-        self.split_limit_label = tk.Label(frm, text="ký tự", font=("Arial", 10))
-        self.split_limit_label.grid(row=3, column=2, padx=(250, 0), sticky="w")
+        self.split_width_var = tk.StringVar(value=SPLIT_WIDTH_LABELS[0])
+        self.split_width_combobox = ttk.Combobox(
+            frm,
+            textvariable=self.split_width_var,
+            values=SPLIT_WIDTH_LABELS,
+            width=12,
+            state="readonly",
+            font=('Arial', 10)
+        )
+        self.split_width_combobox.grid(row=3, column=2, padx=(250, 0), sticky="w")
 
         self.var_entries_frame = tk.Frame(frm)
         self.var_entries_frame.grid(row=4, column=2, columnspan=2, sticky="w", pady=(8, 0), padx=(0,0))
@@ -193,6 +203,34 @@ class TextReplacerApp(tk.Tk):
         self.toggle_default_vars()
         self.on_auto_split_changed()
 
+        self.usage_report_var = tk.IntVar(value=0)
+        self.chk_usage_report = tk.Checkbutton(
+            frm,
+            text="Xuất báo cáo sử dụng từ điển (Usage.xlsx)",
+            variable=self.usage_report_var,
+            font=("Arial", 10)
+        )
+        self.chk_usage_report.grid(row=5, column=2, sticky="w", pady=(2, 2))
+
+        self.fold_match_var = tk.IntVar(value=0)
+        self.chk_fold_match = tk.Checkbutton(
+            frm,
+            text="Không phân biệt hoa/thường, full-width/half-width",
+            variable=self.fold_match_var,
+            font=("Arial", 10)
+        )
+        self.chk_fold_match.grid(row=6, column=2, sticky="w", pady=(2, 2))
+
+        # Bản dùng flashtext chỉ thay nguyên từ; nay mặc định thay cả chuỗi con, bật ô này để giữ cách cũ
+        self.whole_word_var = tk.IntVar(value=1 if MATCH_WHOLE_WORD else 0)
+        self.chk_whole_word = tk.Checkbutton(
+            frm,
+            text="Chỉ thay nguyên từ (\"cat\" không thay trong \"category\")",
+            variable=self.whole_word_var,
+            font=("Arial", 10)
+        )
+        self.chk_whole_word.grid(row=7, column=2, sticky="w", pady=(2, 2))
+
         frm.grid_columnconfigure(2, weight=1)
 
         self.btn_run = tk.Button(
@@ -282,18 +320,24 @@ class TextReplacerApp(tk.Tk):
         if self.icon_state == 1:
             self.chk_auto_split.grid_remove()
             self.entry_split_limit.grid_remove()
-            self.split_limit_label.grid_remove()
+            self.split_width_combobox.grid_remove()
             self.var_entries_frame.grid_remove()
             self.encoding_combobox.grid_remove()
             self.lbl_detect_encoding.grid_remove()
+            self.chk_usage_report.grid_remove()
+            self.chk_fold_match.grid_remove()
+            self.chk_whole_word.grid_remove()
             self.btn_select_input.config(state="normal")
         else:
             self.chk_auto_split.grid()
             self.entry_split_limit.grid()
-            self.split_limit_label.grid()
+            self.split_width_combobox.grid()
             self.var_entries_frame.grid()
             self.encoding_combobox.grid()
             self.lbl_detect_encoding.grid()
+            self.chk_usage_report.grid()
+            self.chk_fold_match.grid()
+            self.chk_whole_word.grid()
             self.btn_select_input.config(state="normal")
 
     def on_auto_split_changed(self):
@@ -425,6 +469,9 @@ class TextReplacerApp(tk.Tk):
             split_limit = 80
 
         auto_split = self.auto_split_var.get() == 1
+        usage_report = self.usage_report_var.get() == 1
+        fold = "nfkc_case" if self.fold_match_var.get() == 1 else None
+        whole_word = self.whole_word_var.get() == 1
 
         label = self.encoding_var.get()
         if label in self.encoding_labels:
@@ -432,6 +479,10 @@ class TextReplacerApp(tk.Tk):
         else:
             encoding = self.detected_encoding or "utf-8"
 
+        split_width = SPLIT_WIDTH_VALUES[SPLIT_WIDTH_LABELS.index(self.split_width_var.get())]
+        if split_width == "bytes":
+            split_width = f"bytes:{encoding}"
+
         if self.use_default_vars_var.get() == 1:
             append_vars = [e.get() for e in self.vars_dynamic_entries if e.get().strip()]
         else:
@@ -443,7 +494,8 @@ class TextReplacerApp(tk.Tk):
             self.progress_label.set("Tiến trình:")
             threading.Thread(
                 target=self.process_file_text,
-                args=(self.selected_input_file, data_file_to_use, auto_split, split_limit, encoding, append_vars),
+                args=(self.selected_input_file, data_file_to_use, auto_split, split_limit, encoding, append_vars,
+                      usage_report, fold, split_width, whole_word),
                 daemon=True
             ).start()
         else:
@@ -456,7 +508,8 @@ class TextReplacerApp(tk.Tk):
                 daemon=True
             ).start()
 
-    def process_file_text(self, input_file, data_file, auto_split, split_limit, input_encoding, append_vars):
+    def process_file_text(self, input_file, data_file, auto_split, split_limit, input_encoding, append_vars,
+                          usage_report=False, fold=None, split_width="chars", whole_word=False):
         self.update_status("Bắt đầu xử lý...")
         process_separated_progress(
             input_file,
@@ -469,7 +522,11 @@ class TextReplacerApp(tk.Tk):
             auto_split,
             split_limit,
             input_encoding,
-            append_vars
+            append_vars,
+            usage_report=usage_report,
+            fold=fold,
+            split_width=split_width,
+            whole_word=whole_word
         )
 
     def process_file_hex(self, data_file, input_encoding):
@@ -492,15 +549,17 @@ class TextReplacerApp(tk.Tk):
             if not patch_list:
                 messagebox.showerror("Lỗi", "Không có patch nào hợp lệ trong file patch_data.xlsx.")
                 return
-            with open(input_file, "rb") as f:
-                original_bytes = f.read()
-            patched_bytes = patch_bytes(original_bytes, patch_list)
-            with open(output_file, "wb") as f:
-                f.write(patched_bytes)
+            plan = plan_patches(patch_list, os.path.getsize(input_file))
+            patch_file(input_file, output_file, plan, throttle_progress(self.update_progress))
+            summary = plan.summary()
             self.progress['value'] = 100
             self.progress_label.set("Hoàn thành!")
             self.update_status(f"Đã lưu file nhị phân: {os.path.basename(output_file)}")
-            messagebox.showinfo("Thành công", f"Đã lưu tệp nhị phân:\n{output_file}")
+            messagebox.showinfo(
+                "Thành công",
+                f"Đã lưu tệp nhị phân:\n{output_file}\n\n"
+                f"{summary['patches']} bản vá, gộp thành {summary['runs']} lần ghi ({summary['bytes']} byte)."
+            )
         except Exception as e:
             if str(e) == "Thiếu cột C":
                 self.update_status("Lỗi: Thiếu cột C")
@@ -541,5 +600,6 @@ class TextReplacerApp(tk.Tk):
         messagebox.showinfo("Thành công", f"Đã lưu tệp kết quả:\n{output_file}")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = TextReplacerApp()
     app.mainloop() 
\ No newline at end of file
@@ -0,0 +1,436 @@
+# benchmark.py
+
+# Đo hiệu năng các bước xử lý với dữ liệu tổng hợp.
+# Chạy: python benchmark.py --sizes 16,64,256,1024   (đơn vị MB)
+#       python benchmark.py --suite pipeline --dict-sizes 1000,100000,1000000 --history bench.json
+# Bộ "pipeline" sinh văn bản (ASCII, shift_jis, gbk, dòng dài, nhiều dòng ngắn) và từ điển
+# tổng hợp rồi đo riêng từng bước. Kết quả được nối vào tệp lịch sử JSON để so với baseline.
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import pandas as pd
+from Functions import (
+    reading_progress, saving_progress, replacing_progress, parallel_replacing_progress,
+    load_dictionary_txt, load_dictionary_excel, load_patch_data_xlsx,
+)
+from libs import detect_encoding, split_long_lines, patch_bytes, patch_file, plan_patches, atomic_write
+from matcher import AhoCorasick
+from dict_cache import file_digest
+
+SAMPLE_LINE = "The quick brown fox 你好世界 jumps over the lazy dog. 0123456789\n"
+
+# Tạo tệp văn bản tổng hợp có kích thước xấp xỉ size byte
+def make_text_file(path, size, encoding='utf-8', line=SAMPLE_LINE):
+    block = (line * max(1, (1024 * 1024) // len(line.encode(encoding)))).encode(encoding)
+    written = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            part = block[:size - written]
+            f.write(part)
+            written += len(part)
+    return written
+
+def _noop(percent):
+    pass
+
+def bench_reading(sizes_mb, workdir, encoding='utf-8'):
+    results = []
+    for size_mb in sizes_mb:
+        path = os.path.join(workdir, f"read_{size_mb}mb.txt")
+        size = make_text_file(path, size_mb * 1024 * 1024, encoding)
+        start = time.perf_counter()
+        content = reading_progress(path, encoding, _noop)
+        seconds = time.perf_counter() - start
+        del content
+        os.remove(path)
+        results.append({
+            "stage": "reading_progress",
+            "bytes": size,
+            "seconds": seconds,
+            "mb_per_s": size / (1024 * 1024) / seconds if seconds else 0.0,
+        })
+    return results
+
+def bench_saving(sizes_mb, workdir, atomic=False):
+    results = []
+    for size_mb in sizes_mb:
+        line_len = len(SAMPLE_LINE)
+        content = SAMPLE_LINE * max(1, size_mb * 1024 * 1024 // line_len)
+        path = os.path.join(workdir, f"save_{size_mb}mb.txt")
+        start = time.perf_counter()
+        saving_progress(path, content, _noop, atomic=atomic)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+        # Đối chiếu với một lần ghi văn bản thông thường
+        ref_path = path + ".ref"
+        with open(ref_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        identical = file_digest(path) == file_digest(ref_path)
+        os.remove(path)
+        os.remove(ref_path)
+        del content
+        results.append({
+            "stage": "saving_progress" + (" (atomic)" if atomic else ""),
+            "bytes": size,
+            "seconds": seconds,
+            "mb_per_s": size / (1024 * 1024) / seconds if seconds else 0.0,
+            "identical": identical,
+        })
+    return results
+
+def bench_parallel(size_mb, workers_list):
+    words = SAMPLE_LINE.split()
+    translation_dict = {w: w.upper() for w in words}
+    automaton = AhoCorasick(translation_dict)
+    content = SAMPLE_LINE * max(1, size_mb * 1024 * 1024 // len(SAMPLE_LINE))
+    start = time.perf_counter()
+    expected = replacing_progress(content, automaton, _noop)
+    seconds = time.perf_counter() - start
+    results = [{
+        "stage": "replacing_progress",
+        "bytes": len(content),
+        "seconds": seconds,
+        "mb_per_s": len(content) / (1024 * 1024) / seconds if seconds else 0.0,
+    }]
+    for workers in workers_list:
+        start = time.perf_counter()
+        replaced = parallel_replacing_progress(content, automaton, _noop, workers)
+        seconds = time.perf_counter() - start
+        results.append({
+            "stage": f"parallel x{workers}",
+            "bytes": len(content),
+            "seconds": seconds,
+            "mb_per_s": len(content) / (1024 * 1024) / seconds if seconds else 0.0,
+            "identical": replaced == expected,
+        })
+    return results
+
+# Các kho văn bản tổng hợp: tên -> (encoding, từ vựng, số từ mỗi dòng, ký tự nối)
+CORPORA = {
+    "ascii": ("utf-8", "the quick brown fox jumps over lazy dog river stone castle sword".split(), 12, " "),
+    "shift_jis": ("shift_jis", "吾輩 猫 名前 無い 東京 武将 城 兵糧 合戦 天下 統一 軍師".split(), 14, ""),
+    "gbk": ("gbk", "你好 世界 欢迎 使用 文本 替换 工具 武将 城池 粮草 天下 军师".split(), 14, ""),
+    "long_lines": ("utf-8", "the quick brown fox jumps over lazy dog river stone castle sword".split(), 400, " "),
+    "short_lines": ("utf-8", "the quick brown fox jumps over lazy dog river stone castle sword".split(), 2, " "),
+}
+
+# Sinh văn bản tổng hợp (chuỗi) khoảng size byte theo kho văn bản đã chọn
+def make_corpus(name, size, seed=0):
+    encoding, words, per_line, sep = CORPORA[name]
+    rnd = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        line = sep.join(rnd.choice(words) for _ in range(per_line)) + "\n"
+        lines.append(line)
+        total += len(line.encode(encoding))
+    return "".join(lines)
+
+# Sinh từ điển tổng hợp gồm count khóa: các từ của kho văn bản (để có khớp) + khóa ngẫu nhiên
+def make_dictionary(name, count, seed=0):
+    words = CORPORA[name][1]
+    rnd = random.Random(seed)
+    translation_dict = {}
+    for w in words[:count]:
+        translation_dict[w] = w.upper() + "_vi"
+    alphabet = "abcdefghijklmnopqrstuvwxyz" if name not in ("shift_jis", "gbk") else "".join(words)
+    while len(translation_dict) < count:
+        key = rnd.choice(words) + "".join(rnd.choice(alphabet) for _ in range(rnd.randint(2, 6)))
+        key += format(len(translation_dict), "x")
+        translation_dict.setdefault(key, key[::-1])
+    return translation_dict
+
+def write_dictionary_txt(path, translation_dict, encoding='utf-8'):
+    with open(path, 'w', encoding=encoding) as f:
+        for k, v in translation_dict.items():
+            f.write(f"{k}={v}\n")
+
+def write_dictionary_xlsx(path, translation_dict):
+    df = pd.DataFrame({"Từ khóa": list(translation_dict.keys()), "Giá trị": list(translation_dict.values())})
+    df.to_excel(path, index=False)
+
+# Đo một bước: thời gian thực, thời gian CPU, thông lượng; func được gọi với các tham số trong args
+def measure(stage, func, size, args=(), **meta):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    record = {
+        "stage": stage,
+        **meta,
+        "bytes": size,
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "mb_per_s": size / (1024 * 1024) / seconds if seconds else 0.0,
+    }
+    return record, result
+
+# Đo các bước phụ thuộc từ điển (nạp, dựng automaton, thay thế) với từ điển tổng hợp count khóa.
+# Trả về (các bản ghi, văn bản đã thay thế); từ điển và automaton được giải phóng khi hàm kết thúc.
+def _bench_dictionary(name, count, content, workdir, excel_max):
+    results = []
+    meta = {"corpus": name, "dict_size": count}
+    translation_dict = make_dictionary(name, count)
+    dict_txt = os.path.join(workdir, f"dict_{name}_{count}.txt")
+    write_dictionary_txt(dict_txt, translation_dict)
+    dict_bytes = os.path.getsize(dict_txt)
+    r, _ = measure("load_dictionary_txt", load_dictionary_txt, dict_bytes, args=(dict_txt, 'utf-8'), **meta)
+    results.append(r)
+    os.remove(dict_txt)
+    if count <= excel_max:
+        dict_xlsx = os.path.join(workdir, f"dict_{name}_{count}.xlsx")
+        write_dictionary_xlsx(dict_xlsx, translation_dict)
+        r, _ = measure("load_dictionary_excel", load_dictionary_excel, os.path.getsize(dict_xlsx),
+                       args=(dict_xlsx,), **meta)
+        results.append(r)
+        os.remove(dict_xlsx)
+    r, automaton = measure("automaton_build", AhoCorasick, dict_bytes, args=(translation_dict,), **meta)
+    results.append(r)
+    r, replaced = measure("replacing_progress", replacing_progress, len(content),
+                          args=(content, automaton, _noop), **meta)
+    results.append(r)
+    return results, replaced
+
+# Đo toàn bộ các bước trên một kho văn bản: nhận diện, đọc, từng cỡ từ điển, tách dòng và ghi
+def _bench_corpus(name, size_mb, dict_sizes, workdir, excel_max, split_limit):
+    results = []
+    encoding = CORPORA[name][0]
+    path = os.path.join(workdir, f"{name}.txt")
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        f.write(make_corpus(name, size_mb * 1024 * 1024))
+    size = os.path.getsize(path)
+    meta = {"corpus": name}
+    r, _ = measure("detect_encoding", detect_encoding, size, args=(path,), **meta)
+    results.append(r)
+    r, content = measure("reading_progress", reading_progress, size, args=(path, encoding, _noop), **meta)
+    results.append(r)
+    os.remove(path)
+    for count in dict_sizes:
+        records, replaced = _bench_dictionary(name, count, content, workdir, excel_max)
+        results += records
+    r, split = measure("split_long_lines", split_long_lines, len(replaced), args=(replaced, split_limit), **meta)
+    results.append(r)
+    out_path = os.path.join(workdir, f"{name}_translated.txt")
+    r, _ = measure("saving_progress", saving_progress, len(split.encode('utf-8')),
+                   args=(out_path, split, _noop), **meta)
+    results.append(r)
+    os.remove(out_path)
+    return results
+
+def bench_pipeline(corpora, size_mb, dict_sizes, workdir, excel_max=100000, split_limit=80):
+    if not dict_sizes:
+        raise ValueError("Bộ pipeline cần ít nhất một kích thước từ điển")
+    results = []
+    for name in corpora:
+        results += _bench_corpus(name, size_mb, dict_sizes, workdir, excel_max, split_limit)
+    return results
+
+# Sinh patch_data.xlsx với count bản vá không chồng lấn trên một tệp nhị phân size byte
+def make_patch_data(path, count, size, seed=0):
+    rnd = random.Random(seed)
+    step = max(2, size // count)
+    rows = []
+    for i in range(count):
+        # Value một token được hiểu là chuỗi văn bản nên luôn sinh ít nhất 2 byte
+        length = rnd.randint(2, min(16, step))
+        value = " ".join(f"{rnd.randrange(256):02X}" for _ in range(rnd.randint(2, length)))
+        rows.append({"Offset": hex(i * step), "Value": value, "Số bytes ghi": str(length)})
+    pd.DataFrame(rows, columns=["Offset", "Value", "Số bytes ghi"]).to_excel(path, index=False)
+
+def bench_patching(patch_counts, size_mb, workdir):
+    results = []
+    size = size_mb * 1024 * 1024
+    original = random.Random(0).randbytes(size)
+    bin_path = os.path.join(workdir, "patch_original.bin")
+    out_path = os.path.join(workdir, "patch_patched.bin")
+    with open(bin_path, "wb") as f:
+        f.write(original)
+    for count in patch_counts:
+        meta = {"patches": count}
+        path = os.path.join(workdir, f"patch_{count}.xlsx")
+        make_patch_data(path, count, size)
+        r, patch_list = measure("load_patch_data_xlsx", lambda: load_patch_data_xlsx(path),
+                                     os.path.getsize(path), **meta)
+        results.append(r)
+        r, plan = measure("patch_plan", lambda: plan_patches(patch_list, size), size, **meta)
+        r["runs"] = len(plan.runs)
+        results.append(r)
+        r, _ = measure("patch_bytes", lambda: patch_bytes(original, patch_list), size, **meta)
+        results.append(r)
+        r, _ = measure("patch_file", lambda: patch_file(bin_path, out_path, patch_list), size, **meta)
+        results.append(r)
+        os.remove(path)
+        os.remove(out_path)
+    os.remove(bin_path)
+    return results
+
+# Luật regex thẻ "<#i:số>" -> "[Ti:số]" và văn bản có chèn các thẻ này (xen với từ của kho văn bản ascii)
+def make_rule_corpus(size, rule_count, seed=0):
+    rnd = random.Random(seed)
+    words = make_corpus("ascii", size, seed).split(" ")
+    for i in range(0, len(words), 8):
+        words[i] = f"<#{rnd.randrange(rule_count)}:{rnd.randrange(10000)}>"
+    return " ".join(words)
+
+# So sánh một lượt quét chung (khóa thường + luật regex) với N lượt riêng (automaton rồi re.sub từng luật)
+def bench_rules(rule_counts, size_mb, literal_count=1000):
+    results = []
+    literals = make_dictionary("ascii", literal_count)
+    for count in rule_counts:
+        meta = {"rules": count}
+        text = make_rule_corpus(size_mb * 1024 * 1024, count)
+        size = len(text)
+        rules = {f"re:<#{i}:([0-9]+)>": f"[T{i}:\\1]" for i in range(count)}
+        combined = AhoCorasick({**literals, **rules}, rule_prefix="re:")
+        literal_only = AhoCorasick(literals)
+        compiled = [(re.compile(k[3:]), v) for k, v in rules.items()]
+
+        def separate():
+            result = literal_only.replace(text)
+            for pattern, template in compiled:
+                result = pattern.sub(template, result)
+            return result
+
+        r, expected = measure("rules_separate_passes", separate, size, **meta)
+        results.append(r)
+        r, replaced = measure("rules_single_pass", lambda: combined.replace(text), size, **meta)
+        r["identical"] = replaced == expected
+        results.append(r)
+    return results
+
+# Bộ nạp Excel cũ (DataFrame + iterrows), giữ lại để so sánh với iter_excel_pairs
+def legacy_load_dictionary_excel(excel_file, sheet_name=0):
+    df = pd.read_excel(excel_file, sheet_name=sheet_name, dtype=str)
+    translation_dict = {}
+    for idx, row in df.iterrows():
+        translation_dict[str(row.iloc[0]).strip()] = str(row.iloc[1]).strip()
+    return translation_dict
+
+def bench_excel_loader(dict_sizes, workdir):
+    results = []
+    for count in dict_sizes:
+        meta = {"dict_size": count}
+        translation_dict = make_dictionary("ascii", count)
+        path = os.path.join(workdir, f"dict_{count}.xlsx")
+        write_dictionary_xlsx(path, translation_dict)
+        size = os.path.getsize(path)
+        r, expected = measure("excel_loader_pandas", lambda: legacy_load_dictionary_excel(path), size, **meta)
+        results.append(r)
+        r, loaded = measure("excel_loader_streaming", lambda: load_dictionary_excel(path), size, **meta)
+        r["identical"] = loaded == expected and list(loaded) == list(expected)
+        results.append(r)
+        os.remove(path)
+    return results
+
+def _record_key(r):
+    return tuple(sorted((k, v) for k, v in r.items()
+                        if k not in ("seconds", "cpu_seconds", "mb_per_s", "identical")))
+
+def load_history(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_history(path, history):
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=1)
+
+def new_run(results, label=None):
+    return {
+        "label": label,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+# Tìm lần chạy baseline: theo nhãn, nếu không có nhãn thì lấy lần chạy gần nhất
+def find_baseline(history, label=None):
+    for run in reversed(history):
+        if label is None or run.get("label") == label:
+            return run
+    return None
+
+# Gắn tỉ lệ thời gian so với baseline (>1 là chậm hơn) cho từng kết quả khớp khóa
+def compare_with_baseline(results, baseline):
+    if not baseline:
+        return results
+    base = {_record_key(r): r for r in baseline["results"]}
+    for r in results:
+        b = base.get(_record_key(r))
+        if b and b["seconds"]:
+            r["vs_baseline"] = r["seconds"] / b["seconds"]
+    return results
+
+def print_results(results):
+    for r in results:
+        per_mb = r["seconds"] / (r["bytes"] / (1024 * 1024)) * 1000 if r["bytes"] else 0.0
+        tag = " ".join(str(r[k]) for k in ("corpus", "dict_size", "patches", "rules") if k in r)
+        line = (f"{r['stage']:<24} {tag:<20} {r['bytes'] / (1024 * 1024):>9.1f} MB "
+                f"{r['seconds']:>9.3f} s {r['mb_per_s']:>9.1f} MB/s {per_mb:>8.2f} ms/MB")
+        if "vs_baseline" in r:
+            line += f"  x{r['vs_baseline']:.2f}"
+        if not r.get("identical", True):
+            line += "  KHÁC KẾT QUẢ!"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Text Replacer")
+    parser.add_argument("--sizes", default="16,64,256", help="Danh sách kích thước tệp (MB), cách nhau bởi dấu phẩy")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--workdir", default=None, help="Thư mục chứa tệp tạm")
+    parser.add_argument("--workers", default="2,4", help="Số tiến trình cần đo cho chế độ song song")
+    parser.add_argument("--suite", choices=["io", "pipeline", "excel", "rules", "all"], default="io",
+                        help="io: đọc/ghi/song song; pipeline: từng bước với kho văn bản và từ điển tổng hợp; "
+                             "excel: bộ nạp từ điển Excel mới so với pandas; "
+                             "rules: luật regex trong một lượt quét so với nhiều lượt riêng")
+    parser.add_argument("--corpora", default=",".join(CORPORA), help="Các kho văn bản cho bộ pipeline")
+    parser.add_argument("--corpus-size", type=int, default=8, help="Kích thước văn bản cho bộ pipeline (MB)")
+    parser.add_argument("--dict-sizes", default="1000,10000,100000", help="Số khóa của các từ điển tổng hợp")
+    parser.add_argument("--excel-max", type=int, default=100000, help="Chỉ đo từ điển Excel tới số khóa này")
+    parser.add_argument("--patches", default="1000,10000", help="Số bản vá cho load_patch_data_xlsx/patch_bytes/patch_file")
+    parser.add_argument("--rules", default="1,10,100", help="Số luật regex cho bộ rules")
+    parser.add_argument("--history", default=None, help="Tệp lịch sử JSON để nối kết quả và so sánh")
+    parser.add_argument("--label", default=None, help="Nhãn cho lần chạy này (vd. baseline)")
+    parser.add_argument("--baseline", default=None, help="Nhãn lần chạy dùng làm baseline (mặc định: lần gần nhất)")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        if args.suite in ("io", "all"):
+            results += bench_reading(sizes, workdir, args.encoding)
+            results += bench_saving(sizes, workdir)
+            results += bench_saving(sizes, workdir, atomic=True)
+            results += bench_parallel(sizes[0], [int(w) for w in args.workers.split(",") if w.strip()])
+        if args.suite in ("pipeline", "all"):
+            corpora = [c for c in args.corpora.split(",") if c.strip()]
+            dict_sizes = [int(n) for n in args.dict_sizes.split(",") if n.strip()]
+            if not dict_sizes:
+                parser.error("--dict-sizes không được để trống với bộ pipeline")
+            results += bench_pipeline(corpora, args.corpus_size, dict_sizes, workdir, args.excel_max)
+            results += bench_patching([int(n) for n in args.patches.split(",") if n.strip()],
+                                      args.corpus_size, workdir)
+        if args.suite in ("excel", "all"):
+            dict_sizes = [int(n) for n in args.dict_sizes.split(",") if n.strip()]
+            results += bench_excel_loader([n for n in dict_sizes if n <= args.excel_max], workdir)
+        if args.suite in ("rules", "all"):
+            results += bench_rules([int(n) for n in args.rules.split(",") if n.strip()], args.corpus_size)
+    history = load_history(args.history)
+    compare_with_baseline(results, find_baseline(history, args.baseline))
+    print_results(results)
+    if args.history:
+        history.append(new_run([{k: v for k, v in r.items() if k != "vs_baseline"} for r in results], args.label))
+        save_history(args.history, history)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# cli.py
+
+# Chạy thay thế hàng loạt không cần giao diện (dùng cho build tự động).
+# Ví dụ:
+#   python cli.py -d dictionary.xlsx scripts/ "extra/*.txt" -j 8 --summary summary.json
+# Có thể truyền nhiều -d: từ điển gốc trước, các lớp đè sau (lớp sau thắng khi trùng khóa).
+# Từ điển chỉ được biên dịch một lần, các tệp được xử lý song song bằng process pool,
+# cuối cùng in/ghi bản tóm tắt JSON (thời gian, số byte, số lần thay thế của từng tệp).
+# --binary: thay chuỗi trực tiếp trong tệp nhị phân (khóa/giá trị mã hóa bằng -e), kết quả <tên>_patched<đuôi>,
+# các khóa không thay được ghi vào <tên>_overflow.xlsx, vd.
+#   python cli.py --binary -e shift_jis -d dictionary.xlsx game.exe
+
+import os
+import sys
+import glob
+import fnmatch
+import json
+import time
+import argparse
+from concurrent.futures import as_completed
+from Functions import (
+    load_dictionary_stack, translate_file, create_replace_pool, resolve_workers,
+    translate_file_task, load_dictionary_pairs, build_binary_matcher, process_binary_replace, binary_replace_task,
+)
+from libs import LineSplitter
+from matcher import FOLD_MODES
+from config import SPLIT_WIDTH, MATCH_WHOLE_WORD
+from manifest import load_manifest, save_manifest, dictionary_snapshot, plan_incremental, record_results
+
+# Mở rộng danh sách đầu vào (tệp, thư mục, glob) thành các cặp (tệp, đường dẫn tương đối)
+def collect_inputs(inputs, pattern="*.txt", output_marker="_translated"):
+    found = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    if fnmatch.fnmatch(name, pattern):
+                        found.append((path, os.path.relpath(path, item)))
+        elif os.path.isfile(item):
+            found.append((item, os.path.basename(item)))
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(path):
+                    found.append((path, os.path.basename(path)))
+    result = []
+    for path, rel in found:
+        key = os.path.abspath(path)
+        if key in seen or os.path.splitext(path)[0].endswith(output_marker):
+            continue
+        seen.add(key)
+        result.append((path, rel))
+    return result
+
+def output_path_for(path, rel, output_dir=None, suffix="_translated", ext=".txt"):
+    base, orig_ext = os.path.splitext(rel if output_dir else path)
+    out = base + suffix + (orig_ext if ext is None else ext)
+    return os.path.join(output_dir, out) if output_dir else out
+
+def _print_popup(title, msg):
+    print(f"[{title}] {msg}", file=sys.stderr)
+
+def run_batch(dict_file, inputs, output_dir=None, workers=None, encoding=None,
+              auto_split=False, split_limit=80, append_vars=None, pattern="*.txt", use_cache=True,
+              manifest_path=None, fold=None, split_width=SPLIT_WIDTH, whole_word=False):
+    started = time.perf_counter()
+    automaton = load_dictionary_stack(
+        dict_file, show_popup=_print_popup, use_cache=use_cache, fold=fold, whole_word=whole_word
+    )
+    dict_seconds = time.perf_counter() - started
+    if auto_split:
+        # Kiểm tra chế độ đo độ rộng và dựng sẵn bảng độ rộng trước khi chia cho các tiến trình con
+        LineSplitter(split_limit, append_vars, split_width)
+    files = []
+    for path, rel in collect_inputs(inputs, pattern):
+        out = output_path_for(path, rel, output_dir)
+        if os.path.dirname(out):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+        files.append((path, out))
+    order = {path: idx for idx, (path, _) in enumerate(files)}
+    results = []
+    if manifest_path:
+        # Chế độ tăng dần: bỏ qua các tệp mà kết quả lần trước vẫn còn đúng
+        options = {
+            "encoding": encoding or "auto",
+            "split": split_limit if auto_split else 0,
+            "split_width": split_width if auto_split else None,
+            "append_vars": list(append_vars or []),
+            "fold": fold,
+            "whole_word": whole_word,
+        }
+        manifest = load_manifest(manifest_path)
+        snapshot = dictionary_snapshot(dict_file, automaton)
+        files, skipped, input_hashes = plan_incremental(manifest, files, options, snapshot, fold, whole_word)
+        for path, out, reason in skipped:
+            results.append({"input": path, "output": out, "skipped": reason})
+    tasks = [(path, out, encoding, auto_split, split_limit, append_vars, bool(manifest_path), split_width)
+             for path, out in files]
+    workers = min(resolve_workers(workers), max(1, len(tasks)))
+    if workers <= 1:
+        for task in tasks:
+            results.append(_run_one(lambda: translate_file(task[0], task[1], automaton, *task[2:]), task))
+    else:
+        with create_replace_pool(automaton, workers) as executor:
+            futures = {executor.submit(translate_file_task, task): task for task in tasks}
+            for future in as_completed(futures):
+                results.append(_run_one(future.result, futures[future]))
+    if manifest_path:
+        record_results(manifest, results, options, snapshot, input_hashes)
+        save_manifest(manifest_path, manifest)
+        for r in results:
+            r.pop("keys", None)
+    results.sort(key=lambda r: order[r["input"]])
+    return {
+        "dictionary": dict_file,
+        "dictionary_entries": len(automaton),
+        "dictionary_seconds": dict_seconds,
+        "workers": workers,
+        "files": results,
+        "total_files": len(results),
+        "failed": sum(1 for r in results if r.get("error")),
+        "skipped": sum(1 for r in results if r.get("skipped")),
+        "total_bytes_in": sum(r.get("bytes_in", 0) for r in results),
+        "total_bytes_out": sum(r.get("bytes_out", 0) for r in results),
+        "total_hits": sum(r.get("hits", 0) for r in results),
+        "total_seconds": time.perf_counter() - started,
+    }
+
+# Thay chuỗi trong các tệp nhị phân; từ điển được mã hóa và biên dịch một lần cho mọi tệp
+def run_binary_batch(dict_file, inputs, encoding, output_dir=None, workers=None, pattern="*"):
+    started = time.perf_counter()
+    matcher, rejected, errors = build_binary_matcher(load_dictionary_pairs(dict_file, _print_popup), encoding)
+    dict_seconds = time.perf_counter() - started
+    tasks = []
+    for path, rel in collect_inputs(inputs, pattern, ("_patched", "_patched_overflow")):
+        out = output_path_for(path, rel, output_dir, "_patched", None)
+        if os.path.dirname(out):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+        tasks.append((path, out, encoding, rejected, errors, os.path.splitext(out)[0] + "_overflow.xlsx"))
+    order = {task[0]: idx for idx, task in enumerate(tasks)}
+    results = []
+    workers = min(resolve_workers(workers), max(1, len(tasks)))
+    if workers <= 1:
+        for task in tasks:
+            results.append(_run_one(lambda: process_binary_replace(
+                task[0], None, encoding, output_file=task[1], report_file=task[5],
+                binary_matcher=(matcher, rejected, errors)), task))
+    else:
+        with create_replace_pool(matcher, workers) as executor:
+            futures = {executor.submit(binary_replace_task, task): task for task in tasks}
+            for future in as_completed(futures):
+                results.append(_run_one(future.result, futures[future]))
+    results.sort(key=lambda r: order[r["input"]])
+    return {
+        "dictionary": dict_file,
+        "dictionary_entries": len(matcher),
+        "dictionary_seconds": dict_seconds,
+        "encoding": encoding,
+        "workers": workers,
+        "files": results,
+        "total_files": len(results),
+        "failed": sum(1 for r in results if r.get("error")),
+        "total_bytes_in": sum(r.get("bytes_in", 0) for r in results),
+        "total_hits": sum(r.get("hits", 0) for r in results),
+        "total_overflow": sum(r.get("overflow", 0) for r in results),
+        "total_seconds": time.perf_counter() - started,
+    }
+
+def _run_one(func, task):
+    try:
+        return func()
+    except Exception as e:
+        return {"input": task[0], "output": task[1], "error": str(e)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Text Replacer - chạy hàng loạt không giao diện")
+    parser.add_argument("inputs", nargs="+", help="Tệp, thư mục hoặc mẫu glob cần xử lý")
+    parser.add_argument("-d", "--dict", required=True, action="append",
+                        help="Tệp từ điển (.xlsx/.txt); lặp lại để thêm lớp đè (lớp sau thắng)")
+    parser.add_argument("-o", "--output-dir", default=None, help="Thư mục kết quả (mặc định: cạnh tệp gốc)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Số tiến trình (0 = theo số CPU)")
+    parser.add_argument("-e", "--encoding", default=None, help="Encoding tệp gốc (mặc định: tự nhận diện)")
+    parser.add_argument("--pattern", default=None,
+                        help="Mẫu tên tệp khi quét thư mục (mặc định: *.txt, hoặc * với --binary)")
+    parser.add_argument("--split", type=int, default=0, help="Tự động tách dòng khi đạt số ký tự này")
+    parser.add_argument("--split-width", default=SPLIT_WIDTH,
+                        help="Cách đo giới hạn tách dòng: chars, columns (CJK = 2 cột) hoặc bytes:<encoding>")
+    parser.add_argument("--append-vars", nargs="*", default=None, help="Biến thêm vào khi tách dòng")
+    parser.add_argument("--summary", default=None, help="Ghi bản tóm tắt JSON ra tệp (mặc định: in ra stdout)")
+    parser.add_argument("--no-cache", action="store_true", help="Không dùng cache từ điển đã biên dịch")
+    parser.add_argument("--incremental", metavar="MANIFEST", default=None,
+                        help="Chạy tăng dần: chỉ xử lý lại các tệp bị ảnh hưởng, trạng thái lưu trong MANIFEST")
+    parser.add_argument("--fold", choices=FOLD_MODES, default=None,
+                        help="So khớp không phân biệt hoa/thường (case), full/half-width (nfkc) hoặc cả hai (nfkc_case)")
+    parser.add_argument("--whole-word", action="store_true", default=MATCH_WHOLE_WORD,
+                        help="Chỉ thay khóa nguyên từ, vd. \"cat\" không thay trong \"category\" (như bản dùng flashtext); "
+                             "mặc định thay mọi chỗ xuất hiện")
+    parser.add_argument("--binary", action="store_true",
+                        help="Thay chuỗi trực tiếp trong tệp nhị phân (cần -e, vd. -e shift_jis)")
+    args = parser.parse_args(argv)
+    if args.binary and not args.encoding:
+        parser.error("--binary cần chỉ định encoding bằng -e")
+
+    try:
+        if args.binary:
+            summary = run_binary_batch(
+                args.dict, args.inputs, args.encoding, args.output_dir, args.jobs, args.pattern or "*"
+            )
+        else:
+            summary = run_batch(
+                args.dict, args.inputs, args.output_dir, args.jobs, args.encoding,
+                args.split > 0, args.split, args.append_vars, args.pattern or "*.txt", not args.no_cache,
+                args.incremental, args.fold, args.split_width, args.whole_word
+            )
+    except Exception as e:
+        if str(e) == "DUPLICATE_DETECTED":
+            print("Từ điển có dòng trùng, xem Duplicate.xlsx", file=sys.stderr)
+        else:
+            print(f"Lỗi: {e}", file=sys.stderr)
+        return 2
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -65,4 +65,56 @@ PRESET_VARS = {
     "other": ['\\r', '\\n']
 }
 
+# Cache từ điển đã biên dịch
+DICT_CACHE_DIR = ".dict_cache"
+DICT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DICT_CACHE_MAX_ENTRIES = 16
+# Từ điển có từ số khóa này trở lên mới dùng thẳng mảng trạng thái trên tệp cache (mmap, không chép);
+# nhỏ hơn thì chép các mảng đó ra list khi nạp vì duyệt list nhanh hơn memoryview
+DICT_CACHE_ZERO_COPY_MIN_ENTRIES = 1000000
+
+# Kích thước khối khi đọc tệp
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Kích thước khối khi ghi tệp và chu kỳ tối thiểu giữa hai lần cập nhật tiến trình (giây)
+WRITE_CHUNK_SIZE = 4 * 1024 * 1024
+PROGRESS_INTERVAL = 0.1
+
+# Xử lý theo luồng cho tệp lớn
+STREAM_MEMORY_LIMIT = 64 * 1024 * 1024
+STREAM_MIN_FILE_SIZE = 256 * 1024 * 1024
+
+# Thay thế song song: số tiến trình (0 = theo số CPU) và kích thước văn bản tối thiểu (ký tự)
+PARALLEL_WORKERS = 0
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+
+# Phát hiện encoding: số byte mẫu tối đa, độ tin cậy tối thiểu, số kết quả được cache
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_MIN_CONFIDENCE = 0.5
+ENCODING_CACHE_SIZE = 64
+
+# Cách đo giới hạn khi tự động tách dòng: "chars" (số ký tự), "columns" (số cột hiển thị, CJK full-width = 2),
+# "bytes:<encoding>" (số byte khi mã hóa, vd. "bytes:shift_jis")
+SPLIT_WIDTH = "chars"
+# Lựa chọn trên giao diện; "bytes" dùng encoding đang chọn của tệp gốc
+SPLIT_WIDTH_VALUES = ["chars", "columns", "bytes"]
+SPLIT_WIDTH_LABELS = ["ký tự", "cột (CJK = 2)", "byte"]
+
+# So khớp không phân biệt: None (chính xác), "case" (hoa/thường), "nfkc" (full/half-width...), "nfkc_case" (cả hai)
+MATCH_FOLD = None
+# Chỉ thay khóa nguyên từ: khóa không được dính liền với chữ/số ASCII hoặc "_" (vd. "cat" không thay trong "category"),
+# giống bộ thay thế flashtext của các bản trước. Mặc định False: thay mọi chỗ xuất hiện (khớp chuỗi con).
+MATCH_WHOLE_WORD = False
+
+# Khóa từ điển bắt đầu bằng tiền tố này là luật regex (giá trị là chuỗi thay thế kiểu re.sub, vd. "\\1").
+# Mặc định None (tắt): mọi khóa đều là chuỗi thường, từ điển cũ giữ nguyên nghĩa.
+# Muốn dùng luật regex thì bật tại đây, vd. REGEX_RULE_PREFIX = "re:"
+REGEX_RULE_PREFIX = None
+
+# Ghi số liệu đo từng bước (thời gian, CPU, byte) ra tệp JSON; None = tắt
+STAGE_LOG_FILE = None
+# Đo thêm bộ nhớ đỉnh từng bước bằng tracemalloc. Mặc định tắt vì tracemalloc làm cả quá trình chậm đi
+# hàng chục lần (thời gian trong log khi đó chủ yếu là của tracemalloc); khi tắt, log chỉ ghi RSS đỉnh của tiến trình
+STAGE_TRACE_MEMORY = False
+
 # ... Thêm các cấu hình khác nếu cần ... 
\ No newline at end of file
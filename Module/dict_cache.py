@@ -0,0 +1,244 @@
+# dict_cache.py
+
+# Bộ nhớ đệm trên đĩa cho automaton đã biên dịch từ từ điển.
+# Khóa cache = hash nội dung tệp từ điển + các tùy chọn so khớp.
+# Định dạng nhị phân gọn: header + các mảng uint32 + vùng chuỗi UTF-8,
+# được nạp lại bằng mmap. Cache bị dọn theo LRU (mtime) và giới hạn dung lượng.
+# Khi nạp, automaton dùng thẳng các mảng trên mmap (không dựng lại đối tượng Python):
+# bảng chuyển trạng thái chỉ được dựng cho những trạng thái thực sự đi qua,
+# khóa/giá trị được giải mã từ vùng chuỗi khi cần.
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from libs import atomic_write
+from matcher import AhoCorasick, FOLD_MODES
+from config import DICT_CACHE_DIR, DICT_CACHE_MAX_BYTES, DICT_CACHE_MAX_ENTRIES, DICT_CACHE_ZERO_COPY_MIN_ENTRIES
+
+CACHE_MAGIC = b"TRDC"
+CACHE_VERSION = 4
+CACHE_EXT = ".trdc"
+# magic, version, byteorder, n_states, n_keys, n_edges, key_pool_len, value_pool_len, fold,
+# số luật regex (nằm cuối danh sách khóa), độ dài tiền tố luật, khớp nguyên từ (0/1)
+_HEADER = struct.Struct("<4sIIIIIQQIIII")
+# Mã chế độ fold lưu trong header: 0 = không fold
+_FOLD_CODES = (None,) + FOLD_MODES
+
+# Hash nội dung tệp theo từng khối lớn
+def file_digest(file_path, block_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(dict_file, options=None):
+    h = hashlib.sha256()
+    h.update(file_digest(dict_file).encode("ascii"))
+    h.update(repr(sorted((options or {}).items())).encode("utf-8"))
+    h.update(str(CACHE_VERSION).encode("ascii"))
+    return h.hexdigest()
+
+def _pool(strings):
+    offsets = array('I', [0])
+    chunks = []
+    total = 0
+    for s in strings:
+        b = s.encode("utf-8", "surrogatepass")
+        chunks.append(b)
+        total += len(b)
+        offsets.append(total)
+    return offsets, b''.join(chunks)
+
+# Chuyển automaton sang dạng nhị phân
+def dump_compiled(automaton):
+    if automaton.buffer is not None:
+        return bytes(automaton.buffer)
+    goto = automaton.goto
+    n_states = len(goto)
+    edge_index = array('I', [0])
+    edge_chars = array('I')
+    edge_targets = array('I')
+    for g in goto:
+        edge_chars.extend(map(ord, g.keys()))
+        edge_targets.extend(g.values())
+        edge_index.append(len(edge_chars))
+    key_offsets, key_pool = _pool(automaton.keys)
+    value_offsets, value_pool = _pool(automaton.values)
+    parts = [_HEADER.pack(
+        CACHE_MAGIC, CACHE_VERSION, 1 if sys.byteorder == "little" else 0,
+        n_states, len(automaton.keys), len(edge_chars), len(key_pool), len(value_pool),
+        _FOLD_CODES.index(automaton.fold), automaton.rule_count, automaton.rule_prefix_len,
+        1 if automaton.whole_word else 0
+    )]
+    for arr in (
+        key_offsets, value_offsets, array('I', automaton.key_lens),
+        array('I', automaton.depth), array('I', automaton.fail), array('i', automaton.out),
+        edge_index, edge_chars, edge_targets
+    ):
+        parts.append(arr.tobytes())
+    parts.append(key_pool)
+    parts.append(value_pool)
+    return b''.join(parts)
+
+# Ghi automaton ra tệp nhị phân
+def save_compiled(automaton, file_path):
+    with atomic_write(file_path, 'wb') as f:
+        f.write(dump_compiled(automaton))
+
+# Bảng chuyển trạng thái dựng dần: goto[s] chỉ được tạo (và giữ lại) ở lần đầu trạng thái s được dùng
+class _LazyGoto(dict):
+    def __init__(self, edge_index, edge_chars, edge_targets):
+        super().__init__()
+        self.edge_index = edge_index
+        self.edge_chars = edge_chars
+        self.edge_targets = edge_targets
+
+    def __missing__(self, s):
+        a, b = self.edge_index[s], self.edge_index[s + 1]
+        edges = dict(zip(map(chr, self.edge_chars[a:b]), self.edge_targets[a:b]))
+        self[s] = edges
+        return edges
+
+# Dãy chuỗi chỉ đọc trên vùng chuỗi UTF-8 + mảng offset, giải mã từng phần tử khi truy cập
+class StringPool:
+    def __init__(self, buffer, start, end, offsets):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.offsets = offsets
+        self.pool = memoryview(buffer)[start:end]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self.pool[self.offsets[i]:self.offsets[i + 1]], "utf-8", "surrogatepass")
+
+    def __iter__(self):
+        pool = self.pool
+        offsets = self.offsets
+        for i in range(len(self)):
+            yield str(pool[offsets[i]:offsets[i + 1]], "utf-8", "surrogatepass")
+
+    # Tìm chuỗi con trực tiếp trên vùng byte, không giải mã từng khóa
+    def contains(self, text):
+        return self.buffer.find(text.encode("utf-8", "surrogatepass"), self.start, self.end) >= 0
+
+# Dựng automaton dùng trực tiếp một buffer nhị phân (bytes, mmap...); buffer được giữ sống cùng automaton.
+# Từ điển dưới zero_copy_min_entries khóa thì các mảng theo trạng thái và khóa/giá trị được chép ra list
+# (goto vẫn dựng dần) để vòng khớp không phải đi qua memoryview.
+def load_compiled_buffer(buffer, zero_copy_min_entries=DICT_CACHE_ZERO_COPY_MIN_ENTRIES):
+    mv = memoryview(buffer)
+    (magic, version, little, n_states, n_keys, n_edges, key_pool_len, value_pool_len, fold_code,
+     rule_count, rule_prefix_len, whole_word) = _HEADER.unpack_from(mv, 0)
+    if (magic != CACHE_MAGIC or version != CACHE_VERSION or fold_code >= len(_FOLD_CODES)
+            or rule_count > n_keys):
+        raise ValueError("Cache không đúng định dạng")
+    if bool(little) != (sys.byteorder == "little"):
+        raise ValueError("Cache khác byteorder")
+    expected = _HEADER.size + 4 * (3 * n_keys + 2 + 4 * n_states + 1 + 2 * n_edges) + key_pool_len + value_pool_len
+    if len(mv) < expected:
+        raise ValueError("Cache bị cắt cụt")
+    pos = _HEADER.size
+
+    def take(count, fmt='I'):
+        nonlocal pos
+        size = count * 4
+        part = mv[pos:pos + size].cast(fmt)
+        pos += size
+        return part
+
+    key_offsets = take(n_keys + 1)
+    value_offsets = take(n_keys + 1)
+    key_lens = take(n_keys)
+    depth = take(n_states)
+    fail = take(n_states)
+    out = take(n_states, 'i')
+    edge_index = take(n_states + 1)
+    edge_chars = take(n_edges)
+    edge_targets = take(n_edges)
+    keys = StringPool(buffer, pos, pos + key_pool_len, key_offsets)
+    pos += key_pool_len
+    values = StringPool(buffer, pos, pos + value_pool_len, value_offsets)
+    goto = _LazyGoto(edge_index, edge_chars, edge_targets)
+    if n_keys < zero_copy_min_entries:
+        key_lens, depth, fail, out = key_lens.tolist(), depth.tolist(), fail.tolist(), out.tolist()
+        keys, values = list(keys), list(values)
+    return AhoCorasick.from_compiled(
+        goto, fail, depth, out, keys, values, key_lens, buffer,
+        _FOLD_CODES[fold_code], rule_count, rule_prefix_len, bool(whole_word)
+    )
+
+# Nạp automaton từ tệp nhị phân qua mmap (mmap được giữ mở suốt vòng đời automaton)
+def load_compiled(file_path):
+    with open(file_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return load_compiled_buffer(mm)
+    except Exception:
+        mm.close()
+        raise
+
+def _cache_path(key, cache_dir):
+    return os.path.join(cache_dir, key + CACHE_EXT)
+
+# Lấy automaton từ cache, trả về None nếu chưa có hoặc cache hỏng
+def get_cached_matcher(key, cache_dir=DICT_CACHE_DIR):
+    path = _cache_path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        automaton = load_compiled(path)
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return automaton
+
+# Lưu automaton vào cache rồi dọn các mục cũ
+def store_cached_matcher(key, automaton, cache_dir=DICT_CACHE_DIR,
+                         max_bytes=DICT_CACHE_MAX_BYTES, max_entries=DICT_CACHE_MAX_ENTRIES):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_compiled(automaton, _cache_path(key, cache_dir))
+    except OSError:
+        return
+    evict_cache(cache_dir, max_bytes, max_entries)
+
+def evict_cache(cache_dir=DICT_CACHE_DIR, max_bytes=DICT_CACHE_MAX_BYTES, max_entries=DICT_CACHE_MAX_ENTRIES):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_EXT):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort(reverse=True)
+    total = 0
+    for idx, (_, size, path) in enumerate(entries):
+        total += size
+        if idx > 0 and (idx >= max_entries or total > max_bytes):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,121 @@
+# instrument.py
+
+# Đo từng bước xử lý: thời gian thực, thời gian CPU, số byte và bộ nhớ đỉnh (tracemalloc, chỉ khi trace_memory
+# vì tracemalloc làm chậm mọi cấp phát; bản tóm tắt luôn kèm RSS đỉnh của tiến trình nếu hệ điều hành hỗ trợ).
+# Mỗi bước kết thúc sẽ tạo một bản ghi (dict) gửi cho callback on_stage,
+# đồng thời được giữ lại để ghi ra tệp JSON khi close().
+# Ví dụ:
+#   recorder = StageRecorder(on_stage=print, trace_memory=True, log_path="stages.json")
+#   with recorder.stage("read", nbytes=size):
+#       ...
+#   recorder.close()
+
+import sys
+import json
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    resource = None
+from contextlib import contextmanager
+from libs import atomic_write
+
+class StageRecorder:
+    def __init__(self, on_stage=None, trace_memory=False, log_path=None, enabled=True):
+        self.on_stage = on_stage
+        self.trace_memory = trace_memory and enabled
+        self.log_path = log_path
+        self.enabled = enabled
+        self.records = []
+        self.info = {}
+        self._started = time.perf_counter()
+        self._own_tracing = False
+        # Đỉnh bộ nhớ (tuyệt đối) của các bước đang mở, để bước con không làm mất đỉnh của bước cha
+        self._peaks = []
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+
+    # Đo một bước; bản ghi được trả về qua "as" để bổ sung thông tin (vd. số byte khi đã biết)
+    @contextmanager
+    def stage(self, name, nbytes=0, **meta):
+        if not self.enabled:
+            yield {}
+            return
+        record = {"stage": name, **meta, "bytes": nbytes}
+        if self.trace_memory:
+            mem_start, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            self._peaks.append(mem_start)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            if self.trace_memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                record["peak_memory"] = peak - mem_start
+            self._emit(record)
+
+    # Cộng dồn một bước đã tự đo bên trong vòng lặp (vd. tách dòng trong lúc thay thế)
+    def add(self, name, seconds, cpu_seconds, nbytes=0, **meta):
+        if not self.enabled:
+            return
+        for record in self.records:
+            if record["stage"] == name and record.get("_open"):
+                record["seconds"] += seconds
+                record["cpu_seconds"] += cpu_seconds
+                record["bytes"] += nbytes
+                return
+        self.records.append({
+            "stage": name, **meta, "bytes": nbytes, "seconds": seconds, "cpu_seconds": cpu_seconds, "_open": True
+        })
+
+    # Khép các bước cộng dồn và gửi cho callback
+    def finish(self, name):
+        for record in self.records:
+            if record["stage"] == name and record.pop("_open", False):
+                if self.on_stage:
+                    self.on_stage(record)
+
+    def _emit(self, record):
+        self.records.append(record)
+        if self.on_stage:
+            self.on_stage(record)
+
+    def summary(self):
+        return {
+            **self.info,
+            "total_seconds": time.perf_counter() - self._started,
+            "peak_rss": peak_rss(),
+            "stages": [{k: v for k, v in r.items() if k != "_open"} for r in self.records],
+        }
+
+    def dump(self, path):
+        with atomic_write(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def close(self):
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+        if self.enabled and self.log_path:
+            self.dump(self.log_path)
+
+# RSS đỉnh (byte) của tiến trình hiện tại từ lúc khởi động, None nếu không đo được
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS trả về byte, Linux/BSD trả về KB
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Bộ ghi rỗng, dùng khi không cần đo để khỏi phải kiểm tra None ở mọi nơi
+NULL_RECORDER = StageRecorder(enabled=False)
@@ -18,7 +18,14 @@
 # ... 
 
 import os
+import re
 import sys
+import shutil
+import codecs
+import unicodedata
+from bisect import bisect_right
+from itertools import accumulate
+from contextlib import contextmanager
 import pandas as pd
 
 # Hàm lấy đường dẫn resource (dùng cho PyInstaller)
@@ -27,57 +34,203 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath("."), relative_path)
 
-# Lưu các dòng trùng lặp vào file Excel
+# Ghi tệp qua <path>.tmp rồi os.replace: tệp đích hoặc còn nguyên bản cũ, hoặc là bản mới đầy đủ.
+# Lỗi giữa chừng (kể cả KeyboardInterrupt) thì xóa tệp tạm; atomic=False thì ghi thẳng vào path.
+@contextmanager
+def atomic_write(path, mode='w', encoding=None, atomic=True):
+    if not atomic:
+        with open(path, mode, encoding=encoding) as f:
+            yield f
+        return
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+DUPLICATE_COLUMNS = ["Dòng", "Từ khóa trùng", "Giá trị"]
+
+# Tìm tất cả các nhóm khóa trùng trong một lần băm theo cột.
+# lines/keys/values là các cột song song của từ điển; trả về DataFrame chỉ gồm các dòng trùng,
+# nhóm xếp theo dòng xuất hiện đầu tiên, trong nhóm xếp theo số dòng.
+def find_duplicate_rows(lines, keys, values):
+    df = pd.DataFrame({"Dòng": lines, "Từ khóa trùng": keys, "Giá trị": values}, columns=DUPLICATE_COLUMNS)
+    df = df[df["Từ khóa trùng"].duplicated(keep=False)]
+    return _sort_duplicate_groups(df)
+
+def _sort_duplicate_groups(df):
+    if df.empty:
+        return df
+    first = df.groupby("Từ khóa trùng", sort=False)["Dòng"].transform("min")
+    return (
+        df.assign(_first=first)
+        .sort_values(["_first", "Dòng", "Giá trị"], kind="stable")
+        .drop(columns="_first")
+        .reset_index(drop=True)
+    )
+
+# Ghi các dòng trùng (đã nhóm) ra Excel, mỗi nhóm cách nhau một dòng "---"; trả về số nhóm
+def save_duplicate_rows_to_excel(dup_rows, file_path="Duplicate.xlsx"):
+    if dup_rows.empty:
+        return 0
+    keys = dup_rows["Từ khóa trùng"]
+    group_id = keys.ne(keys.shift()).cumsum()
+    group_count = int(group_id.iloc[-1])
+    rows = dup_rows.astype({"Dòng": object}).assign(_group=group_id, _order=1)
+    sep = pd.DataFrame({
+        "Dòng": "---", "Từ khóa trùng": "", "Giá trị": "",
+        "_group": range(2, group_count + 1), "_order": 0,
+    })
+    out = pd.concat([rows, sep], ignore_index=True).sort_values(["_group", "_order"], kind="stable")
+    out[DUPLICATE_COLUMNS].to_excel(file_path, index=False)
+    return group_count
+
+# Lưu các dòng trùng lặp vào file Excel (duplicate_info: danh sách (dòng, khóa, giá trị))
 def save_duplicate_to_excel(duplicate_info, file_path="Duplicate.xlsx"):
-    if not duplicate_info:
+    if len(duplicate_info) == 0:
         return 0
-    from collections import defaultdict
-    group = defaultdict(list)
-    for ln, src, tgt in sorted(duplicate_info):
-        group[src].append((ln, src, tgt))
-    rows = []
-    for idx, (src, lst) in enumerate(group.items()):
-        seen_lines = set()
-        for ln, s, tgt in sorted(lst):
-            key = (ln, s, tgt)
-            if key not in seen_lines:
-                rows.append({"Dòng": ln, "Từ khóa trùng": s, "Giá trị": tgt})
-                seen_lines.add(key)
-        rows.append({"Dòng": "---", "Từ khóa trùng": "", "Giá trị": ""})
-    if rows and rows[-1].get("Dòng") == "---":
-        rows.pop()
-    df = pd.DataFrame(rows)
-    df.to_excel(file_path, index=False)
-    return len(group)
+    if not isinstance(duplicate_info, pd.DataFrame):
+        duplicate_info = _sort_duplicate_groups(
+            pd.DataFrame(list(duplicate_info), columns=DUPLICATE_COLUMNS).drop_duplicates()
+        )
+    return save_duplicate_rows_to_excel(duplicate_info, file_path)
 
 # Lưu và cập nhật file Excel khi có dòng trùng
 def save_duplicate_and_update_xlsx(duplicate_info, orig_xlsx, file_path="Duplicate.xlsx"):
-    if not duplicate_info:
+    if len(duplicate_info) == 0:
         return 0
     df = pd.read_excel(orig_xlsx, dtype=str)
-    duplicate_rows_idx = set()
-    for ln, src, tgt in duplicate_info:
-        duplicate_rows_idx.add(ln - 2)
+    if isinstance(duplicate_info, pd.DataFrame):
+        duplicate_rows_idx = set(duplicate_info["Dòng"] - 2)
+    else:
+        duplicate_rows_idx = {ln - 2 for ln, src, tgt in duplicate_info}
     group_count = save_duplicate_to_excel(duplicate_info, file_path)
     df_clean = df.drop(index=list(duplicate_rows_idx))
     df_clean.to_excel(orig_xlsx, index=False)
     return group_count
 
-# Phát hiện encoding file
-def detect_encoding(file_path, sample_size=10000):
-    import chardet
+# Lưu báo cáo sử dụng từ điển: khóa dùng nhiều xếp trước, khóa chưa từng khớp ở cuối
+def save_usage_to_excel(keys, values, counts, first, file_path="Usage.xlsx"):
+    order = sorted(range(len(keys)), key=lambda k: (-counts[k], first[k] if counts[k] else 0, k))
+    rows = []
+    used = 0
+    for k in order:
+        if counts[k]:
+            used += 1
+        rows.append({
+            "Từ khóa": keys[k],
+            "Giá trị": values[k],
+            "Số lần khớp": counts[k],
+            "Vị trí đầu tiên": first[k] if counts[k] else "",
+        })
+    df = pd.DataFrame(rows, columns=["Từ khóa", "Giá trị", "Số lần khớp", "Vị trí đầu tiên"])
+    df.to_excel(file_path, index=False)
+    return used, len(keys) - used
+
+OVERFLOW_COLUMNS = ["Từ khóa", "Giá trị", "Byte khóa", "Byte giá trị", "Số lần gặp", "Offset đầu tiên", "Lý do"]
+
+# Lưu các khóa không thay được trong chế độ thay chuỗi nhị phân (giá trị dài hơn khóa, không mã hóa được...)
+def save_overflow_to_excel(rows, file_path="Overflow.xlsx"):
+    df = pd.DataFrame(rows, columns=OVERFLOW_COLUMNS)
+    df.to_excel(file_path, index=False)
+    return len(rows)
+
+# Phát hiện encoding file: chỉ đọc tối đa sample_size byte đầu tệp, kết quả được cache theo (path, size, mtime)
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+_encoding_cache = {}
+_NON_ASCII = re.compile(rb'[\x80-\xff\x1b]|~\{')
+
+def detect_encoding(file_path, sample_size=None, min_confidence=None):
+    from config import ENCODING_SAMPLE_SIZE, ENCODING_MIN_CONFIDENCE, ENCODING_CACHE_SIZE
+    if sample_size is None:
+        sample_size = ENCODING_SAMPLE_SIZE
+    if min_confidence is None:
+        min_confidence = ENCODING_MIN_CONFIDENCE
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns, sample_size, min_confidence)
+    result = _encoding_cache.get(key)
+    if result is None:
+        result = _detect_encoding_sample(file_path, sample_size, min_confidence)
+        if len(_encoding_cache) >= ENCODING_CACHE_SIZE:
+            _encoding_cache.pop(next(iter(_encoding_cache)))
+        _encoding_cache[key] = result
+    return result
+
+def _detect_encoding_sample(file_path, sample_size, min_confidence):
+    from chardet.universaldetector import UniversalDetector
     with open(file_path, 'rb') as f:
-        detector = chardet.universaldetector.UniversalDetector()
-        for line in f:
-            detector.feed(line)
-            if detector.done:
+        head = f.read(4)
+        for bom, name in _BOMS:
+            if head.startswith(bom):
+                return name, name
+        # Bỏ qua phần đầu chỉ có ASCII (header, ID, mã...) để mẫu đưa cho chardet bắt đầu từ dòng
+        # có ký tự khác đầu tiên; ESC và "~{" được giữ lại vì ISO-2022/HZ cũng chỉ gồm byte ASCII
+        f.seek(0)
+        start = 0
+        while True:
+            block = f.read(64 * 1024)
+            if not block:
+                # Cả tệp là ASCII: giải mã utf-8 cho kết quả y hệt
+                return "utf-8", "ascii"
+            if block.isascii() and b'\x1b' not in block and b'~{' not in block:
+                start += len(block)
+                continue
+            m = _NON_ASCII.search(block)
+            if m is not None:
                 break
+            start += len(block)
+        f.seek(start + block.rfind(b'\n', 0, m.start()) + 1)
+        detector = UniversalDetector()
+        sample = []
+        read_size = 0
+        while read_size < sample_size and not detector.done:
+            block = f.read(min(64 * 1024, sample_size - read_size))
+            if not block:
+                break
+            detector.feed(block)
+            sample.append(block)
+            read_size += len(block)
         detector.close()
     encoding = detector.result['encoding']
+    confidence = detector.result['confidence'] or 0.0
+    if encoding and confidence < min_confidence:
+        # Độ tin cậy thấp: chỉ chấp nhận utf-8 nếu mẫu giải mã được, nếu không thì để người dùng chọn
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(b''.join(sample))
+            return "utf-8", encoding
+        except UnicodeDecodeError:
+            return None, encoding
     if encoding and encoding.lower() == "macroman":
         return "windows-1252", "MacRoman"
+    if encoding == "ascii":
+        # Chỉ gặp ESC/"~{" mà mẫu vẫn là ASCII: không đoán được phần còn lại, để người dùng chọn
+        return None, "ascii"
     return encoding, encoding
 
+# Bọc progress_callback để chỉ gọi tối đa một lần mỗi interval giây (luôn gọi khi đạt 100%)
+def throttle_progress(progress_callback, interval=None):
+    import time
+    if interval is None:
+        from config import PROGRESS_INTERVAL
+        interval = PROGRESS_INTERVAL
+    last = [0.0]
+    def report(percent):
+        now = time.monotonic()
+        if percent >= 100 or now - last[0] >= interval:
+            last[0] = now
+            progress_callback(percent)
+    return report
+
 # Chuyển chuỗi hex sang bytes
 def parse_hex_string(s):
     try:
@@ -93,60 +246,274 @@ def parse_hex_string(s):
     except Exception:
         return s.encode("utf-8")
 
+# Kế hoạch patch: các bản vá được sắp theo offset và gộp những bản vá liền kề/chồng nhau thành một lần ghi.
+# Kết quả áp dụng giống hệt ghi lần lượt theo thứ tự bảng (bản sau thắng khi chồng nhau; offset quá cuối tệp
+# thì ghi nối vào cuối như gán lát cắt trên bytearray). Dùng lại được cho chạy thử và báo cáo (summary()).
+class PatchPlan:
+    def __init__(self, patch_list, size):
+        self.size = size
+        self.patch_count = len(patch_list)
+        # Offset thực tế khi ghi lần lượt: không vượt quá độ dài tệp tại thời điểm ghi
+        end = size
+        placed = []
+        append = placed.append
+        for idx, (offset, value_bytes) in enumerate(patch_list):
+            if offset < 0:
+                raise ValueError(f"Offset âm: {offset}")
+            if not value_bytes:
+                continue
+            if offset > end:
+                offset = end
+            stop = offset + len(value_bytes)
+            if stop > end:
+                end = stop
+            append((offset, idx, stop, value_bytes))
+        self.end = end
+        placed.sort()
+        # Quét theo offset, gom các bản vá nối liền (start <= cuối đoạn hiện tại) vào cùng một đoạn
+        self.runs = []
+        group = []
+        run_end = -1
+        overlapped = False
+        for item in placed:
+            if item[0] > run_end:
+                if group:
+                    self.runs.append(self._merge(group, run_end, overlapped))
+                group = [item]
+                run_end = item[2]
+                overlapped = False
+            else:
+                if item[0] < run_end:
+                    overlapped = True
+                if item[2] > run_end:
+                    run_end = item[2]
+                group.append(item)
+        if group:
+            self.runs.append(self._merge(group, run_end, overlapped))
+
+    @staticmethod
+    def _merge(group, run_end, overlapped):
+        start = group[0][0]
+        if len(group) == 1:
+            return start, bytes(group[0][3])
+        if not overlapped:
+            return start, b"".join([item[3] for item in group])
+        # Chồng nhau: ghi vào bộ đệm của đoạn theo thứ tự bảng để bản sau thắng
+        buf = bytearray(run_end - start)
+        for pos, _, stop, value_bytes in sorted(group, key=lambda item: item[1]):
+            buf[pos - start:stop - start] = value_bytes
+        return start, bytes(buf)
+
+    def summary(self):
+        return {
+            "patches": self.patch_count,
+            "runs": len(self.runs),
+            "bytes": sum(len(data) for _, data in self.runs),
+            "first_offset": self.runs[0][0] if self.runs else None,
+            "last_offset": self.runs[-1][0] + len(self.runs[-1][1]) - 1 if self.runs else None,
+            "size_before": self.size,
+            "size_after": self.end,
+        }
+
+# Lập kế hoạch patch cho dữ liệu dài size byte; nhận cả kế hoạch có sẵn (phải lập cho đúng kích thước đó)
+def plan_patches(patch_list, size):
+    if isinstance(patch_list, PatchPlan):
+        if patch_list.size != size:
+            raise ValueError(f"Kế hoạch patch lập cho {patch_list.size} byte, dữ liệu có {size} byte")
+        return patch_list
+    return PatchPlan(patch_list, size)
+
 # Patch bytes cho file nhị phân
 def patch_bytes(original_bytes, patch_list):
+    plan = plan_patches(patch_list, len(original_bytes))
     arr = bytearray(original_bytes)
-    for offset, value_bytes in patch_list:
-        arr[offset:offset+len(value_bytes)] = value_bytes
+    for offset, data in plan.runs:
+        arr[offset:offset+len(data)] = data
     return bytes(arr)
 
-# Tách dòng dài
-def split_long_lines(text, limit, append_vars=None):
-    import re
+# Patch trực tiếp trên bản sao: sao chép tệp gốc sang output_file (shutil.copyfile, phía kernel khi được hỗ trợ)
+# rồi ghi từng đoạn của kế hoạch patch theo vị trí trên bản sao; bộ nhớ dùng không phụ thuộc kích thước tệp.
+# Kết quả giống hệt patch_bytes, kể cả bản vá vượt cuối tệp; trả về kích thước tệp kết quả.
+def patch_file(input_file, output_file, patch_list, progress_callback=None):
+    plan = plan_patches(patch_list, os.path.getsize(input_file))
+    shutil.copyfile(input_file, output_file)
+    total = len(plan.runs)
+    with open(output_file, "r+b", buffering=0) as f:
+        for i, (offset, data) in enumerate(plan.runs):
+            f.seek(offset)
+            f.write(data)
+            if progress_callback:
+                progress_callback((i + 1) / total * 100)
+    return plan.end
+
+_NON_SPACE = re.compile(r'\S')
+_FORBIDDEN_FIRST = '.,;?!'
+
+# Ký tự kết thúc dòng theo str.splitlines
+_LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# Cuối phần nội dung của một dòng (trước \r\n, \n hoặc \r)
+def _content_end(line):
+    if line.endswith('\r\n'):
+        return len(line) - 2
+    if line[-1] in '\r\n':
+        return len(line) - 1
+    return len(line)
+
+# Cách đo độ dài dòng khi tách: "chars" (số ký tự), "columns" (số cột hiển thị, CJK full-width = 2),
+# "bytes:<encoding>" (số byte khi mã hóa, vd. "bytes:shift_jis")
+SPLIT_WIDTH_MODES = ("chars", "columns", "bytes:<encoding>")
+
+_width_tables = {}
+
+# Bảng độ rộng theo từng code point (bytes dài 0x110000) và độ rộng lớn nhất; None với "chars".
+# Bảng được tính một lần cho mỗi chế độ, sau đó đo một dòng chỉ còn là tra bảng và cộng dồn.
+def _width_table(width):
+    if width in (None, "chars"):
+        return None
+    cached = _width_tables.get(width)
+    if cached is not None:
+        return cached
+    table = bytearray(b'\x01') * 0x110000
+    if width == "columns":
+        # Ngoài mặt phẳng 0-3 không có ký tự rộng; dấu kết hợp và ký tự định dạng không chiếm cột
+        for c in range(0x40000):
+            ch = chr(c)
+            if unicodedata.east_asian_width(ch) in 'WF':
+                table[c] = 2
+            elif unicodedata.category(ch) in ('Mn', 'Me', 'Cf'):
+                table[c] = 0
+    elif width.startswith("bytes:"):
+        encoding = width[6:]
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise ValueError(f"Encoding không hợp lệ cho chế độ tách dòng: {width}")
+        # Mã hóa hai lần để trừ đi BOM (utf-16...); ký tự không mã hóa được tính theo ký tự thay thế
+        for c in range(0x10000):
+            ch = chr(c)
+            table[c] = len((ch + ch).encode(encoding, 'replace')) - len(ch.encode(encoding, 'replace'))
+        astral = '\U00020000'
+        table[0x10000:] = bytes([len((astral * 2).encode(encoding, 'replace')) -
+                                 len(astral.encode(encoding, 'replace'))]) * 0x100000
+    else:
+        raise ValueError(f"Chế độ tách dòng không hợp lệ: {width} (hỗ trợ: {', '.join(SPLIT_WIDTH_MODES)})")
+    cached = (bytes(table), max(table))
+    _width_tables[width] = cached
+    return cached
+
+# Độ rộng cộng dồn: cum[i] = độ rộng của line[:i], tính trong một lần duyệt
+def _cumulative_width(line, table):
+    return list(accumulate(map(table.__getitem__, map(ord, line)), initial=0))
+
+def _split_params(limit, append_vars):
+    append_str = ''.join(append_vars or [])
+    if append_str:
+        return max(1, limit - len(append_vars)), append_str
+    return limit, '\n'
+
+# Cắt nội dung line[:end] thành các phần, đẩy vào append; trả về vị trí bắt đầu phần còn lại.
+# complete=False: dòng chưa kết thúc (nội dung có thể còn tiếp) nên chỉ cắt những chỗ đã chắc chắn.
+# cum: độ rộng cộng dồn của line (None = đếm ký tự), max_len khi đó là độ rộng tối đa của mỗi phần.
+def _split_line(line, end, max_len, separator, append, complete=True, cum=None):
+    pos = 0
+    while (end - pos if cum is None else cum[end] - cum[pos]) > max_len:
+        if cum is None:
+            cut = pos + max_len
+        else:
+            # Vị trí xa nhất mà phần line[pos:cut] còn vừa; một ký tự rộng hơn giới hạn vẫn đứng riêng một phần
+            cut = bisect_right(cum, cum[pos] + max_len, pos, end + 1) - 1
+            if cut == pos:
+                cut = pos + 1
+        space = line.rfind(' ', pos, cut + 1)
+        split_pos = space if space > pos else cut
+        m = _NON_SPACE.search(line, split_pos, end)
+        if m is None and not complete:
+            break
+        rest = m.start() if m else end
+        nxt = rest
+        # Dấu câu không được đứng đầu dòng mới: kéo về cuối phần vừa tách
+        while nxt < end and line[nxt] in _FORBIDDEN_FIRST:
+            nxt += 1
+        if nxt == end and not complete:
+            break
+        append(line[pos:split_pos].rstrip())
+        if nxt > rest:
+            append(line[rest:nxt])
+        append(separator)
+        pos = nxt
+    return pos
+
+# Tách dòng dài: mỗi dòng chỉ được quét tiến một lần bằng chỉ số, các phần được đưa thẳng vào danh sách kết quả.
+# Mỗi biến trong append_vars tính là 1 đơn vị độ rộng; phần nội dung mỗi đoạn luôn được chừa ít nhất 1 đơn vị.
+# width: cách đo giới hạn (xem SPLIT_WIDTH_MODES).
+def split_long_lines(text, limit, append_vars=None, width="chars"):
     if limit <= 0:
         return text
-    append_vars = append_vars or []
-    append_str = ''.join(append_vars)
-    append_cost = len(append_vars)
-    forbidden_first = set(['.', ',', ';', '?', '!'])
-    lines = text.splitlines(keepends=True)
+    max_len, separator = _split_params(limit, append_vars)
+    table = _width_table(width)
     result = []
-    for line in lines:
-        match = re.match(r'^(.*?)(\r\n|\n|\r)?$', line)
-        content, line_ending = match.group(1), match.group(2) or ''
-        if not content:
-            result.append(line_ending)
-            continue
-        current = content
-        if not append_str:
-            parts = []
-            while len(current) > limit:
-                split_pos = current.rfind(' ', 0, limit + 1)
-                if split_pos <= 0:
-                    split_pos = limit
-                part = current[:split_pos].rstrip()
-                rest = current[split_pos:].lstrip()
-                while rest and rest[0] in forbidden_first:
-                    part += rest[0]
-                    rest = rest[1:]
-                parts.append(part + '\n')
-                current = rest
-            parts.append(current + line_ending)
-            result.extend(parts)
-        else:
-            buffer = ""
-            while len(current) + append_cost > limit:
-                max_len = limit - append_cost
-                split_pos = current.rfind(' ', 0, max_len + 1)
-                if split_pos <= 0:
-                    split_pos = max_len
-                part = current[:split_pos].rstrip()
-                rest = current[split_pos:].lstrip()
-                while rest and rest[0] in forbidden_first:
-                    part += rest[0]
-                    rest = rest[1:]
-                buffer += part + append_str
-                current = rest
-            buffer += current + line_ending
-            result.append(buffer)
-    return ''.join(result) 
\ No newline at end of file
+    append = result.append
+    for line in text.splitlines(keepends=True):
+        _split_full_line(line, max_len, separator, append, table)
+    return ''.join(result)
+
+# Tách một dòng trọn vẹn (kể cả ký tự xuống dòng) và đưa kết quả vào append
+def _split_full_line(line, max_len, separator, append, table):
+    if table is None:
+        if len(line) <= max_len:
+            append(line)
+            return
+        cum = None
+    else:
+        if len(line) * table[1] <= max_len:
+            append(line)
+            return
+        cum = _cumulative_width(line, table[0])
+    pos = _split_line(line, _content_end(line), max_len, separator, append, cum=cum)
+    append(line[pos:])
+
+# Tách dòng theo luồng: nhận văn bản theo từng đoạn tùy ý (vd. đầu ra của bộ thay thế),
+# chỉ giữ lại phần chưa chốt của dòng đang dở; ghép các kết quả feed() + flush() giống hệt split_long_lines.
+class LineSplitter:
+    def __init__(self, limit, append_vars=None, width="chars"):
+        self.limit = limit
+        if limit > 0:
+            self.max_len, self.separator = _split_params(limit, append_vars)
+        self.table = _width_table(width)
+        self._carry = ""
+
+    def feed(self, text):
+        if self.limit <= 0:
+            return text
+        buf = self._carry + text if self._carry else text
+        if not buf:
+            return ""
+        max_len = self.max_len
+        separator = self.separator
+        table = self.table
+        result = []
+        append = result.append
+        lines = buf.splitlines(keepends=True)
+        last = lines.pop() if lines[-1][-1] not in _LINE_BREAKS else ""
+        for line in lines:
+            _split_full_line(line, max_len, separator, append, table)
+        if table is None:
+            if len(last) > max_len:
+                last = last[_split_line(last, len(last), max_len, separator, append, complete=False):]
+        elif len(last) * table[1] > max_len:
+            cum = _cumulative_width(last, table[0])
+            last = last[_split_line(last, len(last), max_len, separator, append, complete=False, cum=cum):]
+        self._carry = last
+        return ''.join(result)
+
+    def flush(self):
+        if self.limit <= 0 or not self._carry:
+            return ""
+        line = self._carry
+        self._carry = ""
+        result = []
+        cum = None if self.table is None else _cumulative_width(line, self.table[0])
+        pos = _split_line(line, len(line), self.max_len, self.separator, result.append, cum=cum)
+        result.append(line[pos:])
+        return ''.join(result)
\ No newline at end of file
@@ -0,0 +1,160 @@
+# manifest.py
+
+# Manifest cho chế độ chạy tăng dần (incremental).
+# Với mỗi tệp gốc, manifest lưu hash nội dung, hash từ điển, tùy chọn xử lý và tệp kết quả.
+# Ngoài ra còn lưu hash giá trị của từng khóa và chỉ mục ngược khóa -> tệp đã khớp,
+# để khi từ điển đổi chỉ cần xử lý lại những tệp thực sự bị ảnh hưởng.
+
+import os
+import io
+import json
+import codecs
+import hashlib
+from dict_cache import file_digest
+from libs import atomic_write
+from matcher import AhoCorasick
+from config import REGEX_RULE_PREFIX
+
+MANIFEST_VERSION = 1
+
+def value_digest(value):
+    return hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=8).hexdigest()
+
+def new_manifest():
+    return {"version": MANIFEST_VERSION, "dictionary": None, "files": {}, "key_index": {}}
+
+def load_manifest(path):
+    if not path or not os.path.exists(path):
+        return new_manifest()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return new_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        return new_manifest()
+    return manifest
+
+def save_manifest(path, manifest):
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+# Ảnh chụp từ điển: hash tệp + hash giá trị của từng khóa.
+# Với từ điển xếp chồng, hash gộp theo thứ tự các lớp và giá trị của lớp sau đè lớp trước.
+def dictionary_snapshot(dict_file, automaton):
+    if isinstance(dict_file, str):
+        dict_hash = file_digest(dict_file)
+    else:
+        dict_hash = hashlib.sha256("|".join(file_digest(p) for p in dict_file).encode("ascii")).hexdigest()
+    return {
+        "path": dict_file,
+        "hash": dict_hash,
+        "values": {k: value_digest(v) for k, v in zip(automaton.keys, automaton.values)},
+    }
+
+# So sánh hai ảnh chụp: trả về (khóa bị đổi giá trị hoặc bị xóa, khóa mới thêm)
+def diff_dictionary(old_snapshot, new_snapshot):
+    old_values = (old_snapshot or {}).get("values", {})
+    new_values = new_snapshot["values"]
+    changed = {k for k, h in old_values.items() if new_values.get(k) != h}
+    added = [k for k in new_values if k not in old_values]
+    return changed, added
+
+# Kiểm tra tệp có chứa ít nhất một khóa của automaton hay không (chỉ đọc, không ghi)
+def file_contains_any(path, encoding, automaton, block_size=4 * 1024 * 1024):
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    replacer = automaton.replacer()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            final = not block
+            replacer.feed(decoder.decode(block, final=final))
+            if final:
+                replacer.flush()
+            if replacer.hits:
+                return True
+            if final:
+                return False
+
+def _options_key(options):
+    return json.loads(json.dumps(options))
+
+# Chia danh sách tệp thành (cần xử lý, bỏ qua) dựa trên manifest của lần chạy trước.
+# files: danh sách (input, output); fold, whole_word: chế độ so khớp của lần chạy (khóa mới phải khớp giống hệt
+# lúc thay thế); trả về (to_process, skipped, input_hashes)
+def plan_incremental(manifest, files, options, snapshot, fold=None, whole_word=False):
+    options = _options_key(options)
+    old_snapshot = manifest.get("dictionary")
+    if old_snapshot and old_snapshot.get("hash") != snapshot["hash"]:
+        changed, added = diff_dictionary(old_snapshot, snapshot)
+    else:
+        changed, added = set(), []
+    affected = set()
+    for key in changed:
+        affected.update(manifest.get("key_index", {}).get(key, ()))
+    added_matcher = AhoCorasick({k: "" for k in added}, fold, REGEX_RULE_PREFIX, whole_word) if added else None
+
+    to_process = []
+    skipped = []
+    input_hashes = {}
+    for input_file, output_file in files:
+        key = os.path.abspath(input_file)
+        input_hash = file_digest(input_file)
+        input_hashes[key] = input_hash
+        entry = manifest["files"].get(key)
+        reusable = (
+            entry is not None
+            and entry.get("input_hash") == input_hash
+            and entry.get("options") == options
+            and entry.get("output") == os.path.abspath(output_file)
+            and os.path.exists(output_file)
+            and os.path.getsize(output_file) == entry.get("bytes_out")
+        )
+        if not reusable:
+            to_process.append((input_file, output_file))
+        elif entry.get("dict_hash") == snapshot["hash"]:
+            skipped.append((input_file, output_file, "unchanged"))
+        elif not old_snapshot or entry.get("dict_hash") != old_snapshot.get("hash"):
+            to_process.append((input_file, output_file))
+        elif key in affected:
+            to_process.append((input_file, output_file))
+        elif added_matcher is not None and file_contains_any(input_file, entry["encoding"], added_matcher):
+            to_process.append((input_file, output_file))
+        else:
+            skipped.append((input_file, output_file, "unaffected"))
+    return to_process, skipped, input_hashes
+
+# Ghi kết quả lần chạy vào manifest và cập nhật chỉ mục ngược khóa -> tệp
+def record_results(manifest, results, options, snapshot, input_hashes):
+    options = _options_key(options)
+    per_file = {}
+    for key, paths in manifest.get("key_index", {}).items():
+        for path in paths:
+            per_file.setdefault(path, []).append(key)
+    for r in results:
+        if r.get("error") or r.get("skipped"):
+            continue
+        key = os.path.abspath(r["input"])
+        manifest["files"][key] = {
+            "input_hash": input_hashes.get(key) or file_digest(r["input"]),
+            "dict_hash": snapshot["hash"],
+            "options": options,
+            "encoding": r["encoding"],
+            "output": os.path.abspath(r["output"]),
+            "output_hash": file_digest(r["output"]),
+            "bytes_out": r["bytes_out"],
+        }
+        per_file[key] = r.get("keys", [])
+    for r in results:
+        if r.get("skipped"):
+            entry = manifest["files"].get(os.path.abspath(r["input"]))
+            if entry is not None:
+                entry["dict_hash"] = snapshot["hash"]
+    key_index = {}
+    for path, keys in per_file.items():
+        for k in keys:
+            key_index.setdefault(k, []).append(path)
+    manifest["key_index"] = key_index
+    manifest["dictionary"] = snapshot
+    return manifest
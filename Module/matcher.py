@@ -0,0 +1,795 @@
+# matcher.py
+
+# Bộ so khớp Aho-Corasick dùng cho bước thay thế từ điển.
+# Ngữ nghĩa: khớp trái nhất, nếu cùng vị trí bắt đầu thì lấy khóa dài nhất
+# (giống nhánh regex cũ với các khóa sắp theo độ dài giảm dần).
+# Trạng thái được giữ lại giữa các lần feed(), nên kết quả không phụ thuộc
+# vào cách cắt chunk, và chi phí tỉ lệ với độ dài văn bản chứ không phải số khóa.
+# Tùy chọn fold ("case", "nfkc", "nfkc_case") so khớp không phân biệt hoa/thường và/hoặc dạng
+# full-width/half-width: khóa được fold khi dựng, văn bản được fold theo từng cửa sổ khi quét
+# (bảng 1:1 theo ký tự nên vị trí không đổi), phần thay thế áp lên đúng đoạn của văn bản gốc.
+# LayeredAutomaton chạy đồng thời nhiều automaton (từ điển gốc + các lớp đè) trên cùng văn bản,
+# cho kết quả giống như so khớp với từ điển đã gộp, trong đó lớp sau thắng khi trùng khóa.
+# Luật regex (khóa có tiền tố rule_prefix, vd. "re:") chạy chung một lượt quét với khóa thường:
+# vị trí kế tiếp có tiền tố chữ (hoặc ký tự đầu) của một luật được tìm bằng một regex gộp,
+# regex của luật chỉ được thử tại các vị trí đó và cạnh tranh với khóa thường theo cùng luật
+# trái nhất/dài nhất (cùng đoạn thì khóa thường thắng). Một lần khớp regex dài tối đa RULE_LOOKAHEAD ký tự;
+# ^, \A và lookbehind chỉ thấy phần văn bản đang nằm trong bộ đệm.
+# Tùy chọn whole_word chỉ nhận khóa nguyên từ (như flashtext trước đây): đầu/cuối khóa là chữ, số ASCII
+# hoặc "_" thì không được dính liền với một ký tự như vậy trong văn bản. Ký tự khác (CJK, dấu câu...)
+# không tạo ranh giới nên văn bản CJK vẫn khớp như thường. Luật regex không bị ảnh hưởng (dùng \b nếu cần).
+
+import re
+import string
+import unicodedata
+from collections import deque
+try:
+    import re._parser as _sre_parse
+    import re._constants as _sre
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre
+
+FOLD_MODES = ("case", "nfkc", "nfkc_case")
+# Số ký tự tối đa được fold mỗi lần, để không tạo bản sao đã fold của cả văn bản lớn
+FOLD_WINDOW = 64 * 1024
+_fold_tables = {}
+# Độ dài tối đa của một lần khớp regex; khi stream, luật kích hoạt gần cuối bộ đệm được để dành cho lần feed sau
+RULE_LOOKAHEAD = 4096
+# Số ký tự đầu tối đa của một luật không có tiền tố chữ
+_MAX_FIRST_CHARS = 256
+# Ký tự "chữ" khi so khớp nguyên từ, giống non_word_boundaries mặc định của flashtext
+WORD_CHARS = frozenset(string.ascii_letters + string.digits + "_")
+
+# Fold một ký tự; chỉ nhận kết quả đúng 1 ký tự (vd. "ß" -> "ss" hay "㍻" -> "平成" được giữ nguyên)
+def _fold_char(ch, mode):
+    if mode in ("nfkc", "nfkc_case"):
+        n = unicodedata.normalize("NFKC", ch)
+        if len(n) == 1:
+            ch = n
+    if mode in ("case", "nfkc_case"):
+        f = ch.casefold()
+        if len(f) != 1:
+            f = ch.lower()
+        if len(f) == 1:
+            ch = f
+    return ch
+
+# Bảng fold cho str.translate trên toàn bộ BMP, dựng một lần cho mỗi chế độ
+def fold_table(mode):
+    if mode is None:
+        return None
+    table = _fold_tables.get(mode)
+    if table is None:
+        if mode not in FOLD_MODES:
+            raise ValueError(f"Chế độ fold không hợp lệ: {mode}")
+        table = {}
+        for cp in range(0x10000):
+            if 0xD800 <= cp < 0xE000:
+                continue
+            ch = chr(cp)
+            f = _fold_char(ch, mode)
+            if f != ch:
+                table[cp] = f
+        _fold_tables[mode] = table
+    return table
+
+def _case_variants(ch, icase):
+    if not icase:
+        return {ch}
+    return {ch, ch.lower(), ch.upper()}
+
+# Tập ký tự có thể mở đầu một dãy phần tử regex đã phân tích; trả về (tập, có thể khớp rỗng)
+# Tập None = không giới hạn được (., lớp phủ định, \w...)
+def _first_chars(items, icase):
+    chars = set()
+    for op, av in items:
+        s, nullable = _first_of(op, av, icase)
+        if s is None:
+            return None, False
+        chars |= s
+        if len(chars) > _MAX_FIRST_CHARS:
+            return None, False
+        if not nullable:
+            return chars, False
+    return chars, True
+
+def _first_of(op, av, icase):
+    if op == _sre.LITERAL:
+        return _case_variants(chr(av), icase), False
+    if op == _sre.IN:
+        chars = set()
+        for iop, iav in av:
+            if iop == _sre.LITERAL:
+                chars |= _case_variants(chr(iav), icase)
+            elif iop == _sre.RANGE and iav[1] - iav[0] < _MAX_FIRST_CHARS:
+                for cp in range(iav[0], iav[1] + 1):
+                    chars |= _case_variants(chr(cp), icase)
+            else:
+                return None, False
+        return chars, False
+    if op == _sre.SUBPATTERN:
+        _, add_flags, del_flags, sub = av
+        if add_flags & re.IGNORECASE:
+            icase = True
+        if del_flags & re.IGNORECASE:
+            icase = False
+        return _first_chars(sub, icase)
+    if op == _sre.BRANCH:
+        chars = set()
+        nullable = False
+        for alt in av[1]:
+            s, n = _first_chars(alt, icase)
+            if s is None:
+                return None, False
+            chars |= s
+            nullable = nullable or n
+        return chars, nullable
+    if op in (_sre.MAX_REPEAT, _sre.MIN_REPEAT, getattr(_sre, "POSSESSIVE_REPEAT", None)):
+        lo, _, sub = av
+        s, n = _first_chars(sub, icase)
+        return s, n or lo == 0
+    if op == getattr(_sre, "ATOMIC_GROUP", None):
+        return _first_chars(av, icase)
+    if op in (_sre.AT, _sre.ASSERT, _sre.ASSERT_NOT):
+        return set(), True
+    return None, False
+
+# Các chuỗi kích hoạt của một luật: tiền tố chữ bắt buộc, nếu không có thì tập ký tự đầu
+def rule_triggers(pattern):
+    icase = bool(pattern.flags & re.IGNORECASE)
+    items = list(_sre_parse.parse(pattern.pattern, pattern.flags))
+    prefix = []
+    if not icase:
+        for op, av in items:
+            if op != _sre.LITERAL:
+                break
+            prefix.append(chr(av))
+    if prefix:
+        return [''.join(prefix)]
+    chars, nullable = _first_chars(items, icase)
+    if not chars or nullable:
+        raise ValueError(f"Luật regex không có tiền tố hoặc tập ký tự đầu xác định: {pattern.pattern}")
+    return sorted(chars)
+
+# Hàm dựng chuỗi thay thế cho một lần khớp; None nếu chuỗi thay thế không có tham chiếu nhóm/escape.
+# Python < 3.12: phân tích template một lần thay vì mỗi lần gọi match.expand
+def _compile_expand(pattern, template):
+    if '\\' not in template:
+        return None
+    parsed = _sre_parse.parse_template(template, pattern)
+    if not isinstance(parsed, tuple):
+        return lambda m: m.expand(template)
+    groups, literals = parsed
+
+    def expand(m):
+        parts = list(literals)
+        for index, group in groups:
+            parts[index] = m.group(group) or ''
+        return ''.join(parts)
+    return expand
+
+# Các luật regex đã biên dịch cùng regex tìm vị trí kích hoạt
+# rules: danh sách (chỉ số khóa toàn cục, mẫu regex, chuỗi thay thế kiểu re.sub)
+class PatternRules:
+    def __init__(self, rules, table=None):
+        self.patterns = []
+        self.templates = []
+        self.expanders = []
+        self.gids = []
+        by_trigger = {}
+        for gid, source, template in rules:
+            pattern = re.compile(source)
+            for trigger in rule_triggers(pattern):
+                if table is not None:
+                    trigger = trigger.translate(table)
+                by_trigger.setdefault(trigger, []).append(len(self.patterns))
+            self.patterns.append(pattern)
+            self.templates.append(template)
+            self.expanders.append(_compile_expand(pattern, template))
+            self.gids.append(gid)
+        # Chuỗi kích hoạt -> các luật cần thử khi nó khớp (gồm luật của mọi chuỗi kích hoạt là tiền tố của nó),
+        # theo thứ tự luật; regex tìm kiếm ưu tiên chuỗi dài nên tại mỗi vị trí chỉ cần tra một lần
+        self.trigger_rules = {}
+        for trigger in by_trigger:
+            ids = set()
+            for cut in range(1, len(trigger) + 1):
+                ids.update(by_trigger.get(trigger[:cut], ()))
+            self.trigger_rules[trigger] = sorted(ids)
+        self.first_chars = {trigger[0] for trigger in by_trigger}
+        self.max_trigger = max(map(len, by_trigger), default=0)
+        # Tìm vị trí kích hoạt kế tiếp ngay trong C, vòng quét chỉ phải so sánh vị trí
+        self.search = re.compile(
+            '|'.join(re.escape(t) for t in sorted(by_trigger, key=len, reverse=True))
+        ).search if by_trigger else None
+        self.lookahead = max(RULE_LOOKAHEAD, self.max_trigger)
+
+    def __len__(self):
+        return len(self.patterns)
+
+# Khớp luật cần thêm văn bản (khi stream): phần còn lại được để dành cho lần feed sau
+_NEED_MORE = object()
+
+# Các vị trí kích hoạt luật regex trong một lần quét bộ đệm, dùng chung cho StreamReplacer và LayeredStreamReplacer.
+# next: vị trí kích hoạt kế tiếp cần xét (-1 = cần tìm lại, n = không còn);
+# last: vị trí kích hoạt vừa xét (các vị trí trước điểm tiếp tục có thể đã bị bỏ qua ở lần feed trước)
+class _RuleCursor:
+    def __init__(self, rules, buf, scan, start, final):
+        self.rules = rules
+        self.buf = buf
+        self.scan = scan
+        self.final = final
+        self.n = len(buf)
+        # Khi stream, chuỗi kích hoạt có thể bị cắt ở cuối bộ đệm: từ edge trở đi vị trí nào cũng phải xét
+        self.edge = self.n - rules.max_trigger + 1 if not final else self.n
+        self.next = -1
+        self.last = start
+        self.match = None
+
+    def _seek(self, i):
+        m = self.rules.search(self.scan, i)
+        self.match = m
+        nxt = m.start() if m else self.n
+        self.next = max(i, self.edge) if nxt > self.edge else nxt
+
+    # Xét vị trí i (i >= next). Khớp đang chờ (pending) luôn bắt đầu sớm hơn, nên chỉ thử luật khi chưa có.
+    # Trả về (end, chỉ số khóa, giá trị đã mở rộng) của luật khớp dài nhất tại i, None, hoặc _NEED_MORE
+    def visit(self, i, pending):
+        if i > self.next:
+            self._seek(i)
+            if i != self.next:
+                return None
+        best = None
+        if not pending:
+            rules = self.rules
+            lookahead = rules.lookahead
+            if not self.final and i + lookahead > self.n:
+                return _NEED_MORE
+            for r in rules.trigger_rules[self.match.group()]:
+                m = rules.patterns[r].match(self.buf, i, i + lookahead)
+                if m is not None:
+                    e = m.end()
+                    if e > i and (best is None or e > best[0]):
+                        expand = rules.expanders[r]
+                        best = (e, rules.gids[r], rules.templates[r] if expand is None else expand(m))
+        self.last = i
+        self._seek(i + 1)
+        return best
+
+    # Sau khi chốt khớp, quét quay lại pe: các vị trí kích hoạt đã bỏ qua từ pe trở đi phải được xét lại
+    def rewind(self, pe):
+        if self.last >= pe:
+            self.next = -1
+        return self.next
+
+class AhoCorasick:
+    # rule_prefix: khóa bắt đầu bằng tiền tố này là luật regex (lưu cuối danh sách khóa, không vào trie)
+    # whole_word: chỉ thay khóa nguyên từ (xem đầu tệp)
+    def __init__(self, translation_dict, fold=None, rule_prefix=None, whole_word=False):
+        table = fold_table(fold)
+        goto = [{}]
+        depth = [0]
+        term = [-1]
+        keys = []
+        values = []
+        rules = {}
+        for key, value in translation_dict.items():
+            if not key:
+                continue
+            if rule_prefix and key.startswith(rule_prefix):
+                rules[key] = value
+                continue
+            s = 0
+            for ch in (key.translate(table) if table is not None else key):
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    depth.append(depth[s] + 1)
+                    term.append(-1)
+                s = nxt
+            if term[s] < 0:
+                term[s] = len(keys)
+                keys.append(key)
+                values.append(value)
+            else:
+                values[term[s]] = value
+
+        # Liên kết thất bại (BFS); out[s] = khóa dài nhất là hậu tố của trạng thái s
+        fail = [0] * len(goto)
+        out = term[:]
+        queue = deque(goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, t in goto[s].items():
+                queue.append(t)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[t] = f
+                if out[t] < 0:
+                    out[t] = out[f]
+
+        rule_prefix_len = len(rule_prefix) if rules else 0
+        for key, value in rules.items():
+            # Kiểm tra luật ngay khi dựng để báo lỗi sớm
+            try:
+                pattern = re.compile(key[rule_prefix_len:])
+                _sre_parse.parse_template(value, pattern)
+            except re.error as e:
+                raise ValueError(f"Luật regex không hợp lệ: {key} ({e})")
+            rule_triggers(pattern)
+            keys.append(key)
+            values.append(value)
+        self._setup(goto, fail, depth, out, keys, values, [len(k) for k in keys], fold=fold,
+                    rule_count=len(rules), rule_prefix_len=rule_prefix_len, whole_word=whole_word)
+
+    # Dựng lại automaton từ các mảng đã biên dịch (dùng khi nạp từ cache)
+    # Các mảng có thể là list hoặc memoryview trên buffer nhị phân (buffer giữ cho chúng còn hiệu lực)
+    @classmethod
+    def from_compiled(cls, goto, fail, depth, out, keys, values, key_lens, buffer=None, fold=None,
+                      rule_count=0, rule_prefix_len=0, whole_word=False):
+        self = cls.__new__(cls)
+        self._setup(goto, fail, depth, out, keys, values, key_lens, buffer, fold, rule_count, rule_prefix_len,
+                    whole_word)
+        return self
+
+    def _setup(self, goto, fail, depth, out, keys, values, key_lens, buffer=None, fold=None,
+               rule_count=0, rule_prefix_len=0, whole_word=False):
+        self.whole_word = bool(whole_word)
+        self.rule_count = rule_count
+        self.rule_prefix_len = rule_prefix_len
+        self.fold = fold
+        self.fold_table = fold_table(fold)
+        self.buffer = buffer
+        self.goto = goto
+        self.fail = fail
+        self.depth = depth
+        self.out = out
+        self.keys = keys
+        self.values = values
+        self.key_lens = key_lens
+        self.rules = PatternRules(self.rule_entries(), self.fold_table) if rule_count else None
+        # Regex các ký tự có thể mở đầu một khóa (hoặc kích hoạt luật), dùng để nhảy qua đoạn không liên quan
+        chars = set(goto[0])
+        if self.rules is not None:
+            chars.update(self.rules.first_chars)
+        if chars:
+            self.first_chars = re.compile(
+                '[' + ''.join(re.escape(ch) for ch in sorted(chars)) + ']'
+            )
+        else:
+            self.first_chars = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Có khóa nào chứa chuỗi text hay không
+    def keys_contain(self, text):
+        contains = getattr(self.keys, "contains", None)
+        if contains is not None:
+            return contains(text)
+        return any(text in k for k in self.keys)
+
+    # Các luật regex: (chỉ số khóa, mẫu regex, chuỗi thay thế)
+    def rule_entries(self):
+        n = len(self.keys)
+        cut = self.rule_prefix_len
+        return [(k, self.keys[k][cut:], self.values[k]) for k in range(n - self.rule_count, n)]
+
+    def replacer(self, collect_stats=False):
+        return StreamReplacer(self, collect_stats)
+
+    def replace(self, text):
+        r = StreamReplacer(self)
+        return r.feed(text) + r.flush()
+
+class StreamReplacer:
+    def __init__(self, automaton, collect_stats=False):
+        self.ac = automaton
+        self.hits = 0
+        # Thống kê theo khóa: số lần khớp và vị trí (ký tự) khớp đầu tiên trong văn bản vào
+        if collect_stats:
+            self.counts = [0] * len(automaton.keys)
+            self.first = [-1] * len(automaton.keys)
+        else:
+            self.counts = None
+            self.first = None
+        self._base = 0
+        self._carry = ""
+        self._pos = 0
+        self._state = 0
+        # Ký tự (đã fold) ngay trước bộ đệm, để xét ranh giới từ ở đầu bộ đệm; "" = đầu văn bản
+        self._prev = ""
+        # (bắt đầu, kết thúc, khóa, giá trị đã mở rộng của luật regex hoặc None)
+        self._pending = (-1, -1, -1, None)
+
+    def feed(self, text):
+        if self.ac.fold_table is not None and len(text) > FOLD_WINDOW:
+            return ''.join(
+                self._scan(text[i:i + FOLD_WINDOW], final=False) for i in range(0, len(text), FOLD_WINDOW)
+            )
+        return self._scan(text, final=False)
+
+    def matched_keys(self):
+        if self.counts is None:
+            return []
+        keys = self.ac.keys
+        return [keys[k] for k, c in enumerate(self.counts) if c]
+
+    # Gộp kết quả của một đoạn xử lý riêng (vd. ở tiến trình con) bắt đầu tại offset base:
+    # hits luôn được cộng, stats (từ sparse_stats) rỗng khi đoạn đó không thu thống kê theo khóa
+    def merge_stats(self, stats, base=0, hits=0):
+        self.hits += hits
+        counts = self.counts
+        if counts is None:
+            return
+        first = self.first
+        for k, (count, offset) in stats.items():
+            counts[k] += count
+            if first[k] < 0 or base + offset < first[k]:
+                first[k] = base + offset
+
+    def sparse_stats(self):
+        if self.counts is None:
+            return {}
+        return {k: (c, self.first[k]) for k, c in enumerate(self.counts) if c}
+
+    def flush(self):
+        return self._scan("", final=True)
+
+    # Chế độ nguyên từ: trong các khóa kết thúc tại i (khóa dài nhất k = out[state], rồi các khóa ngắn hơn
+    # theo liên kết thất bại) trả về khóa dài nhất không dính liền với chữ ở hai đầu, -1 nếu không có.
+    # Khi chưa chốt (không final) bộ quét luôn dừng trước ký tự cuối bộ đệm nên scan[i] đã có.
+    def _word_key(self, scan, n, i, state, k, fail, out, key_lens):
+        if i < n and scan[i] in WORD_CHARS and scan[i - 1] in WORD_CHARS:
+            return -1
+        while k >= 0:
+            st = i - key_lens[k]
+            if scan[st] not in WORD_CHARS or (scan[st - 1] if st else self._prev) not in WORD_CHARS:
+                return k
+            while state and out[state] == k:
+                state = fail[state]
+            k = out[state]
+        return -1
+
+    def _scan(self, text, final):
+        ac = self.ac
+        if ac.first_chars is None:
+            return text
+        goto = ac.goto
+        fail = ac.fail
+        depth = ac.depth
+        out = ac.out
+        key_lens = ac.key_lens
+        values = ac.values
+        skip = ac.first_chars.search
+        rules = ac.rules if ac.rules is not None and ac.rules.search is not None else None
+
+        buf = self._carry + text if self._carry else text
+        # Quét trên bản đã fold (cùng độ dài), còn cắt/ghép luôn lấy từ buf gốc
+        scan = buf.translate(ac.fold_table) if ac.fold_table is not None else buf
+        n = len(buf)
+        # Khớp nguyên từ cần biết ký tự ngay sau khóa: khi stream, ký tự cuối được để dành cho lần feed sau
+        whole_word = ac.whole_word
+        limit = n - 1 if whole_word and not final else n
+        i = self._pos
+        state = self._state
+        ps, pe, pk, pv = self._pending
+        # Vị trí kích hoạt luật regex kế tiếp (-1 = cần tìm lại, n = không còn), chép ra biến cục bộ
+        # để vòng quét chỉ phải so sánh số
+        rule_cursor = _RuleCursor(rules, buf, scan, i, final) if rules is not None else None
+        tnext = -1 if rules is not None else n
+        emit = 0
+        hits = 0
+        parts = []
+        append = parts.append
+        counts = self.counts
+        first = self.first
+        base = self._base
+
+        while True:
+            while i < limit:
+                if i >= tnext:
+                    rule = rule_cursor.visit(i, ps >= 0)
+                    tnext = rule_cursor.next
+                    if rule is not None:
+                        if rule is _NEED_MORE:
+                            # Luật regex cần thêm văn bản: để dành cho lần feed sau
+                            break
+                        ps = i
+                        pe, pk, pv = rule
+                ch = scan[i]
+                nxt = goto[state].get(ch)
+                while nxt is None and state:
+                    state = fail[state]
+                    nxt = goto[state].get(ch)
+                i += 1
+                if nxt is None:
+                    state = 0
+                    if ps < 0:
+                        m = skip(scan, i)
+                        i = m.start() if m else n
+                        continue
+                    # Không còn tiền tố nào sống sót bắt đầu <= ps: chốt khớp
+                    append(buf[emit:ps])
+                    append(values[pk] if pv is None else pv)
+                    hits += 1
+                    if counts is not None:
+                        counts[pk] += 1
+                        if first[pk] < 0:
+                            first[pk] = base + ps
+                    emit = i = pe
+                    # Quay lại pe: các vị trí kích hoạt đã bỏ qua từ pe trở đi phải được xét lại
+                    if rule_cursor is not None:
+                        tnext = rule_cursor.rewind(pe)
+                    ps = -1
+                    continue
+                state = nxt
+                k = out[state]
+                if k >= 0 and whole_word:
+                    k = self._word_key(scan, n, i, state, k, fail, out, key_lens)
+                if k >= 0:
+                    st = i - key_lens[k]
+                    if ps < 0 or st < ps or (st == ps and i >= pe):
+                        ps, pe, pk, pv = st, i, k, None
+                if ps >= 0 and i - depth[state] > ps:
+                    append(buf[emit:ps])
+                    append(values[pk] if pv is None else pv)
+                    hits += 1
+                    if counts is not None:
+                        counts[pk] += 1
+                        if first[pk] < 0:
+                            first[pk] = base + ps
+                    emit = i = pe
+                    # Quay lại pe: các vị trí kích hoạt đã bỏ qua từ pe trở đi phải được xét lại
+                    if rule_cursor is not None:
+                        tnext = rule_cursor.rewind(pe)
+                    state = 0
+                    ps = -1
+            if final and ps >= 0:
+                append(buf[emit:ps])
+                append(values[pk] if pv is None else pv)
+                hits += 1
+                if counts is not None:
+                    counts[pk] += 1
+                    if first[pk] < 0:
+                        first[pk] = base + ps
+                emit = i = pe
+                if rule_cursor is not None:
+                    tnext = rule_cursor.rewind(pe)
+                state = 0
+                ps = -1
+                continue
+            break
+
+        self.hits += hits
+        if final:
+            append(buf[emit:])
+            self._base += n
+            self._carry = ""
+            self._pos = 0
+            self._state = 0
+            self._prev = ""
+            self._pending = (-1, -1, -1, None)
+        else:
+            # Phần từ đầu tiền tố đang sống trở đi phải giữ lại cho lần feed sau
+            safe = i - depth[state]
+            if safe:
+                self._prev = scan[safe - 1]
+            append(buf[emit:safe])
+            self._base += safe
+            self._carry = buf[safe:]
+            self._pos = i - safe
+            self._state = state
+            if ps >= 0:
+                self._pending = (ps - safe, pe - safe, pk, pv)
+            else:
+                self._pending = (-1, -1, -1, None)
+        return ''.join(parts)
+
+# Dãy nối nhiều dãy con (khóa/giá trị của các lớp), chỉ số toàn cục = offset lớp + chỉ số trong lớp
+class ConcatSequence:
+    def __init__(self, parts):
+        self.parts = parts
+        self.offsets = []
+        total = 0
+        for part in parts:
+            self.offsets.append(total)
+            total += len(part)
+        self.total = total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.total
+        for part, off in zip(reversed(self.parts), reversed(self.offsets)):
+            if i >= off:
+                return part[i - off]
+        raise IndexError(i)
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+class LayeredAutomaton:
+    # layers: danh sách AhoCorasick theo thứ tự gốc -> lớp đè (lớp sau thắng)
+    def __init__(self, layers):
+        self.layers = list(layers)
+        if len({layer.fold for layer in self.layers}) > 1:
+            raise ValueError("Các lớp từ điển phải dùng cùng chế độ fold")
+        if len({layer.whole_word for layer in self.layers}) > 1:
+            raise ValueError("Các lớp từ điển phải dùng cùng chế độ khớp nguyên từ")
+        self.fold = self.layers[0].fold if self.layers else None
+        self.whole_word = self.layers[0].whole_word if self.layers else False
+        self.fold_table = fold_table(self.fold)
+        self.keys = ConcatSequence([layer.keys for layer in self.layers])
+        self.values = ConcatSequence([layer.values for layer in self.layers])
+        self.buffer = None
+        # Luật regex của mọi lớp; cùng mẫu thì lớp sau thắng
+        rules = {}
+        for layer, off in zip(self.layers, self.keys.offsets):
+            for k, source, template in layer.rule_entries():
+                rules[source] = (off + k, template)
+        self.rules = PatternRules(
+            [(gid, source, template) for source, (gid, template) in rules.items()], self.fold_table
+        ) if rules else None
+        self.rule_count = len(rules)
+        chars = set()
+        for layer in self.layers:
+            chars.update(layer.goto[0])
+        if self.rules is not None:
+            chars.update(self.rules.first_chars)
+        if chars:
+            self.first_chars = re.compile('[' + ''.join(re.escape(ch) for ch in sorted(chars)) + ']')
+        else:
+            self.first_chars = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def keys_contain(self, text):
+        return any(layer.keys_contain(text) for layer in self.layers)
+
+    def replacer(self, collect_stats=False):
+        return LayeredStreamReplacer(self, collect_stats)
+
+    def replace(self, text):
+        r = LayeredStreamReplacer(self)
+        return r.feed(text) + r.flush()
+
+# Giống StreamReplacer nhưng giữ một trạng thái cho mỗi lớp; khớp được chốt khi không lớp nào
+# còn tiền tố sống bắt đầu <= vị trí khớp đang chờ. Cùng (vị trí, độ dài) thì lớp sau thắng.
+# Luật regex được thử ngay tại vị trí kích hoạt khi chưa có khớp nào đang chờ (khớp đang chờ luôn bắt đầu
+# sớm hơn); khớp regex có thể kéo dài quá vị trí quét, khóa thường cùng điểm bắt đầu chỉ thắng khi dài bằng hoặc hơn.
+class LayeredStreamReplacer(StreamReplacer):
+    def __init__(self, automaton, collect_stats=False):
+        super().__init__(automaton, collect_stats)
+        self._states = [0] * len(automaton.layers)
+
+    def _scan(self, text, final):
+        ac = self.ac
+        if ac.first_chars is None:
+            return text
+        layers = [
+            (layer.goto, layer.fail, layer.depth, layer.out, layer.key_lens, off)
+            for layer, off in zip(ac.layers, ac.keys.offsets)
+        ]
+        values = ac.values
+        skip = ac.first_chars.search
+        rules = ac.rules if ac.rules is not None and ac.rules.search is not None else None
+
+        buf = self._carry + text if self._carry else text
+        scan = buf.translate(ac.fold_table) if ac.fold_table is not None else buf
+        n = len(buf)
+        whole_word = ac.whole_word
+        limit = n - 1 if whole_word and not final else n
+        i = self._pos
+        states = self._states
+        ps, pe, pk, pv = self._pending
+        # Vị trí kích hoạt luật regex kế tiếp (-1 = cần tìm lại, n = không còn)
+        rule_cursor = _RuleCursor(rules, buf, scan, i, final) if rules is not None else None
+        tnext = -1 if rules is not None else n
+        emit = 0
+        hits = 0
+        parts = []
+        append = parts.append
+        counts = self.counts
+        first = self.first
+        base = self._base
+
+        while True:
+            while i < limit:
+                if i >= tnext:
+                    rule = rule_cursor.visit(i, ps >= 0)
+                    tnext = rule_cursor.next
+                    if rule is not None:
+                        if rule is _NEED_MORE:
+                            # Luật regex cần thêm văn bản: để dành cho lần feed sau
+                            break
+                        ps = i
+                        pe, pk, pv = rule
+                ch = scan[i]
+                i += 1
+                live = i
+                for li, (goto, fail, depth, out, key_lens, off) in enumerate(layers):
+                    state = states[li]
+                    nxt = goto[state].get(ch)
+                    while nxt is None and state:
+                        state = fail[state]
+                        nxt = goto[state].get(ch)
+                    if nxt is None:
+                        states[li] = 0
+                        continue
+                    states[li] = nxt
+                    k = out[nxt]
+                    if k >= 0 and whole_word:
+                        k = self._word_key(scan, n, i, nxt, k, fail, out, key_lens)
+                    if k >= 0:
+                        st = i - key_lens[k]
+                        if ps < 0 or st < ps or (st == ps and i >= pe):
+                            ps, pe, pk, pv = st, i, off + k, None
+                    start = i - depth[nxt]
+                    if start < live:
+                        live = start
+                if ps < 0:
+                    if live == i:
+                        m = skip(scan, i)
+                        i = m.start() if m else n
+                    continue
+                if live > ps:
+                    # Không lớp nào còn tiền tố sống bắt đầu <= ps: chốt khớp
+                    append(buf[emit:ps])
+                    append(values[pk] if pv is None else pv)
+                    hits += 1
+                    if counts is not None:
+                        counts[pk] += 1
+                        if first[pk] < 0:
+                            first[pk] = base + ps
+                    emit = i = pe
+                    states[:] = [0] * len(states)
+                    if rule_cursor is not None:
+                        tnext = rule_cursor.rewind(pe)
+                    ps = -1
+            if final and ps >= 0:
+                append(buf[emit:ps])
+                append(values[pk] if pv is None else pv)
+                hits += 1
+                if counts is not None:
+                    counts[pk] += 1
+                    if first[pk] < 0:
+                        first[pk] = base + ps
+                emit = i = pe
+                states[:] = [0] * len(states)
+                if rule_cursor is not None:
+                    tnext = rule_cursor.rewind(pe)
+                ps = -1
+                continue
+            break
+
+        self.hits += hits
+        if final:
+            append(buf[emit:])
+            self._base += n
+            self._carry = ""
+            self._pos = 0
+            states[:] = [0] * len(states)
+            self._prev = ""
+            self._pending = (-1, -1, -1, None)
+            return ''.join(parts)
+        safe = i - max(layer[2][s] for layer, s in zip(layers, states))
+        if safe:
+            self._prev = scan[safe - 1]
+        append(buf[emit:safe])
+        self._base += safe
+        self._carry = buf[safe:]
+        self._pos = i - safe
+        if ps >= 0:
+            self._pending = (ps - safe, pe - safe, pk, pv)
+        else:
+            self._pending = (-1, -1, -1, None)
+        return ''.join(parts)
@@ -0,0 +1,280 @@
+# test_matcher.py
+
+# Kiểm tra ngẫu nhiên bộ so khớp Aho-Corasick:
+# - replace() một lần so với bản tham chiếu (regex các khóa sắp theo độ dài giảm dần = trái nhất, dài nhất),
+# - feed() theo từng chunk ngẫu nhiên so với replace() một lần,
+# - thống kê theo khóa, bản nạp lại từ cache nhị phân, từ điển nhiều lớp, so khớp có fold
+#   (hoa/thường, full/half-width), luật regex và chế độ khớp nguyên từ.
+# Chạy: python -m pytest tests   hoặc   python -m unittest discover tests
+
+import os
+import re
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Module"))
+
+import matcher
+from matcher import AhoCorasick, LayeredAutomaton, WORD_CHARS, FOLD_MODES, fold_table, rule_triggers
+from dict_cache import dump_compiled, load_compiled_buffer
+
+def reference_replace(text, translation_dict):
+    keys = sorted((k for k in translation_dict if k), key=len, reverse=True)
+    if not keys:
+        return text
+    pattern = re.compile('|'.join(re.escape(k) for k in keys))
+    return pattern.sub(lambda m: translation_dict[m.group(0)], text)
+
+# Bản tham chiếu cho so khớp có fold: tìm trên văn bản đã fold, thay trên đúng đoạn của văn bản gốc.
+# Các lớp được fold lần lượt, khóa fold trùng nhau thì lớp (hoặc dòng) sau thắng
+def reference_replace_folded(text, layers, mode):
+    table = fold_table(mode)
+    folded = {k.translate(table): v for d in layers for k, v in d.items() if k}
+    if not folded:
+        return text
+    pattern = re.compile('|'.join(re.escape(k) for k in sorted(folded, key=len, reverse=True)))
+    out = []
+    last = 0
+    for m in pattern.finditer(text.translate(table)):
+        out.append(text[last:m.start()])
+        out.append(folded[m.group()])
+        last = m.end()
+    out.append(text[last:])
+    return ''.join(out)
+
+# Bản tham chiếu cho luật regex (khóa có tiền tố "re:"): tại mỗi vị trí lấy khớp dài nhất giữa khóa thường
+# và luật (mỗi lần khớp luật dài tối đa lookahead ký tự), cùng độ dài thì khóa thường thắng
+def reference_replace_rules(text, layers, fold, lookahead):
+    table = fold_table(fold)
+    literals = {}
+    rules = {}
+    for d in layers:
+        for k, v in d.items():
+            if k.startswith("re:"):
+                rules[k[3:]] = v
+            else:
+                literals[k.translate(table) if table else k] = v
+    compiled = [(re.compile(source), template) for source, template in rules.items()]
+    scan = text.translate(table) if table else text
+    out = []
+    i = 0
+    emit = 0
+    while i < len(text):
+        best = None
+        for k, v in literals.items():
+            if scan.startswith(k, i) and (best is None or len(k) > best[0]):
+                best = (len(k), v)
+        for pattern, template in compiled:
+            m = pattern.match(text, i, i + lookahead)
+            if m and m.end() > i and (best is None or m.end() - i > best[0]):
+                best = (m.end() - i, m.expand(template))
+        if best:
+            out.append(text[emit:i])
+            out.append(best[1])
+            i += best[0]
+            emit = i
+        else:
+            i += 1
+    out.append(text[emit:])
+    return ''.join(out)
+
+# Bản tham chiếu cho khớp nguyên từ: tại mỗi vị trí thử khóa dài nhất trước, khóa chỉ được nhận
+# khi đầu/cuối là ký tự chữ thì không dính liền với một ký tự chữ khác
+def reference_replace_whole_word(text, translation_dict):
+    keys = sorted((k for k in translation_dict if k), key=len, reverse=True)
+    out = []
+    i = 0
+    while i < len(text):
+        for k in keys:
+            e = i + len(k)
+            if not text.startswith(k, i):
+                continue
+            if i > 0 and text[i - 1] in WORD_CHARS and text[i] in WORD_CHARS:
+                continue
+            if e < len(text) and text[e] in WORD_CHARS and text[e - 1] in WORD_CHARS:
+                continue
+            out.append(translation_dict[k])
+            i = e
+            break
+        else:
+            out.append(text[i])
+            i += 1
+    return ''.join(out)
+
+def random_dict(rnd, alpha, max_len=5, max_keys=8):
+    return {
+        ''.join(rnd.choice(alpha) for _ in range(rnd.randint(1, max_len))): f"<{rnd.randint(0, 99)}>"
+        for _ in range(rnd.randint(0, max_keys))
+    }
+
+def random_text(rnd, alpha, max_len=60):
+    return ''.join(rnd.choice(alpha) for _ in range(rnd.randint(0, max_len)))
+
+# Thay thế qua feed() với các chunk dài ngẫu nhiên
+def chunked_replace(automaton, text, rnd, max_chunk=7, collect_stats=False):
+    replacer = automaton.replacer(collect_stats)
+    parts = []
+    i = 0
+    while i < len(text):
+        size = rnd.randint(1, max_chunk)
+        parts.append(replacer.feed(text[i:i + size]))
+        i += size
+    parts.append(replacer.flush())
+    return ''.join(parts), replacer
+
+class MatcherTest(unittest.TestCase):
+    def test_replace_matches_reference(self):
+        rnd = random.Random(1)
+        for _ in range(2000):
+            alpha = 'abc\n'[:rnd.randint(2, 4)]
+            d = random_dict(rnd, alpha)
+            text = random_text(rnd, alpha + 'xy')
+            self.assertEqual(AhoCorasick(d).replace(text), reference_replace(text, d), (d, text))
+
+    def test_chunked_feed_matches_one_shot(self):
+        rnd = random.Random(2)
+        for _ in range(2000):
+            alpha = 'abc\n'[:rnd.randint(2, 4)]
+            d = random_dict(rnd, alpha)
+            text = random_text(rnd, alpha + 'xy')
+            automaton = AhoCorasick(d)
+            got, replacer = chunked_replace(automaton, text, rnd)
+            self.assertEqual(got, automaton.replace(text), (d, text))
+            self.assertEqual(replacer.hits, len(list(re.finditer(
+                '|'.join(re.escape(k) for k in sorted(d, key=len, reverse=True)), text))) if d else 0)
+
+    def test_stats_match_reference(self):
+        rnd = random.Random(3)
+        for _ in range(1000):
+            d = random_dict(rnd, 'abc', max_len=4)
+            text = random_text(rnd, 'abcx', 80)
+            expected = {}
+            if d:
+                pattern = re.compile('|'.join(re.escape(k) for k in sorted(d, key=len, reverse=True)))
+                for m in pattern.finditer(text):
+                    count, first = expected.get(m.group(), (0, m.start()))
+                    expected[m.group()] = (count + 1, first)
+            automaton = AhoCorasick(d)
+            _, replacer = chunked_replace(automaton, text, rnd, 9, collect_stats=True)
+            got = {automaton.keys[k]: v for k, v in replacer.sparse_stats().items()}
+            self.assertEqual(got, expected, (d, text))
+
+    def test_compiled_automaton_matches(self):
+        rnd = random.Random(4)
+        for _ in range(500):
+            d = random_dict(rnd, 'ab猫\n')
+            text = random_text(rnd, 'ab猫\nx')
+            for copy_min in (0, 1 << 30):
+                loaded = load_compiled_buffer(dump_compiled(AhoCorasick(d)), copy_min)
+                self.assertEqual(chunked_replace(loaded, text, rnd)[0], reference_replace(text, d), (d, text))
+
+    # Các lớp từ điển phải cho kết quả (và thống kê) giống từ điển đã gộp, lớp sau thắng khi trùng khóa
+    def test_layered_matches_merged(self):
+        rnd = random.Random(6)
+        for it in range(2000):
+            alpha = 'abc\n'[:rnd.randint(2, 4)]
+            layers = [random_dict(rnd, alpha, 5, 7) for _ in range(rnd.randint(1, 3))]
+            merged = {}
+            for d in layers:
+                merged.update(d)
+            text = random_text(rnd, alpha + 'xy', 70)
+            automata = [AhoCorasick(d) for d in layers]
+            if it % 2:
+                automata = [load_compiled_buffer(dump_compiled(a)) for a in automata]
+            layered = LayeredAutomaton(automata)
+            self.assertEqual(layered.replace(text), reference_replace(text, merged), (layers, text))
+            got, replacer = chunked_replace(layered, text, rnd, collect_stats=True)
+            self.assertEqual(got, reference_replace(text, merged), (layers, text))
+            merged_automaton = AhoCorasick(merged)
+            _, merged_replacer = chunked_replace(merged_automaton, text, rnd, collect_stats=True)
+            self.assertEqual(
+                {layered.keys[k]: v for k, v in replacer.sparse_stats().items()},
+                {merged_automaton.keys[k]: v for k, v in merged_replacer.sparse_stats().items()},
+                (layers, text)
+            )
+
+    def test_fold_matches_reference(self):
+        rnd = random.Random(7)
+        alpha = 'aAＡａbBｂß\n'
+        window = matcher.FOLD_WINDOW
+        # Cửa sổ fold nhỏ để các lần feed dài cũng đi qua nhánh cắt cửa sổ
+        matcher.FOLD_WINDOW = 5
+        try:
+            for it in range(2000):
+                mode = rnd.choice(FOLD_MODES)
+                layers = [random_dict(rnd, alpha, 4, 6) for _ in range(rnd.randint(1, 2))]
+                text = random_text(rnd, alpha + 'x', 40)
+                automata = [AhoCorasick(d, fold=mode) for d in layers]
+                if it % 2:
+                    automata = [load_compiled_buffer(dump_compiled(a)) for a in automata]
+                automaton = automata[0] if len(automata) == 1 else LayeredAutomaton(automata)
+                expected = reference_replace_folded(text, layers, mode)
+                self.assertEqual(automaton.replace(text), expected, (mode, layers, text))
+                self.assertEqual(chunked_replace(automaton, text, rnd, 12)[0], expected, (mode, layers, text))
+        finally:
+            matcher.FOLD_WINDOW = window
+
+    def test_fold_keeps_original_text(self):
+        automaton = AhoCorasick({"Hello": "Xin chào", "ＡＢＣ": "abc!"}, fold="nfkc_case")
+        self.assertEqual(automaton.replace("HELLO hello Ｈｅｌｌｏ abc ABC ａｂｃ Straße"),
+                         "Xin chào Xin chào Xin chào abc! abc! abc! Straße")
+
+    def test_rules_match_reference(self):
+        rules = [r"a\d+", r"[bc]a+", r"(?i)ab", r"ab|ba", r"c(a|b)*c", r"[0-9][0-9]", r"(b)(\d)", r"x?ca", r"ca[0-9]"]
+        templates = ["<\\g<0>>", "X", "[\\g<0>]", "Y", "{\\1}", "#", "\\2\\1", "Z", "Q\\g<0>"]
+        for pattern in rules:
+            self.assertTrue(rule_triggers(re.compile(pattern)))
+        rnd = random.Random(8)
+        # Lookahead nhỏ để khi stream, luật kích hoạt gần cuối bộ đệm phải chờ lần feed sau
+        for lookahead in (4096, 6):
+            for _ in range(1500):
+                fold = rnd.choice([None, None, "case"])
+                layers = []
+                for _ in range(rnd.choice([1, 1, 2])):
+                    d = {}
+                    for _ in range(rnd.randint(0, 5)):
+                        d[''.join(rnd.choice("abcAB1") for _ in range(rnd.randint(1, 3)))] = rnd.choice(["L1", "L2", ""])
+                    for _ in range(rnd.randint(0, 3)):
+                        j = rnd.randrange(len(rules))
+                        d["re:" + rules[j]] = templates[j]
+                    layers.append(d)
+                text = ''.join(rnd.choice("abcAB12x") for _ in range(rnd.randint(0, 60)))
+                automata = [AhoCorasick(d, fold, rule_prefix="re:") for d in layers]
+                automaton = automata[0] if len(automata) == 1 else LayeredAutomaton(automata)
+                if automaton.rules is not None:
+                    automaton.rules.lookahead = lookahead
+                expected = reference_replace_rules(text, layers, fold, lookahead)
+                self.assertEqual(automaton.replace(text), expected, (layers, fold, text))
+                self.assertEqual(chunked_replace(automaton, text, rnd)[0], expected, (layers, fold, text))
+
+    def test_whole_word(self):
+        automaton = AhoCorasick({"cat": "mèo", "big cat": "hổ", "猫": "mèo"}, whole_word=True)
+        self.assertEqual(automaton.replace("cat category bobcat cat_ cat."), "mèo category bobcat cat_ mèo.")
+        self.assertEqual(automaton.replace("xbig cat"), "xbig mèo")
+        self.assertEqual(automaton.replace("吾輩は猫である"), "吾輩はmèoである")
+        self.assertEqual(AhoCorasick({"CAT": "mèo"}, fold="case", whole_word=True).replace("Cat Cats"), "mèo Cats")
+
+    def test_whole_word_matches_reference(self):
+        rnd = random.Random(5)
+        alpha = 'ab -猫'
+        for it in range(3000):
+            layers = [random_dict(rnd, alpha, 4, 6) for _ in range(rnd.randint(1, 2))]
+            merged = {}
+            for d in layers:
+                merged.update(d)
+            text = random_text(rnd, alpha + '\n', 50)
+            automata = [AhoCorasick(d, whole_word=True) for d in layers]
+            if it % 2:
+                automata = [load_compiled_buffer(dump_compiled(a)) for a in automata]
+            automaton = automata[0] if len(automata) == 1 else LayeredAutomaton(automata)
+            expected = reference_replace_whole_word(text, merged)
+            self.assertEqual(automaton.replace(text), expected, (layers, text))
+            self.assertEqual(chunked_replace(automaton, text, rnd)[0], expected, (layers, text))
+
+    def test_layers_must_share_whole_word(self):
+        with self.assertRaises(ValueError):
+            LayeredAutomaton([AhoCorasick({"a": "b"}), AhoCorasick({"c": "d"}, whole_word=True)])
+
+if __name__ == "__main__":
+    unittest.main()
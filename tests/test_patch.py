@@ -0,0 +1,100 @@
+# test_patch.py
+
+# Kiểm tra phát hiện chồng lấn bản vá: chỉ mục khoảng đã nhận (_AcceptedRanges) và load_patch_data_xlsx
+# so với cách gốc là so dòng hiện tại lần lượt với mọi khoảng đã ghi theo thứ tự nhận.
+# Chạy: python -m pytest tests   hoặc   python -m unittest discover tests
+
+import os
+import sys
+import random
+import tempfile
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Module"))
+
+from Functions import _AcceptedRanges, load_patch_data_xlsx
+
+# Khoảng đã nhận đầu tiên (theo thứ tự nhận) chồng lên [start, end], -1 nếu không có
+def first_overlap(accepted, ranges, start, end):
+    for pos in accepted:
+        s, e = ranges[pos]
+        if not (end < s or start > e):
+            return pos
+    return -1
+
+class AcceptedRangesTest(unittest.TestCase):
+    def test_matches_linear_scan(self):
+        rnd = random.Random(1)
+        for _ in range(2000):
+            span = rnd.choice([8, 40, 200])
+            ranges = []
+            for _ in range(rnd.randint(0, 40)):
+                start = rnd.randint(0, span)
+                ranges.append((start, start + rnd.randint(-3, 12)))
+            index = _AcceptedRanges(ranges)
+            accepted = []
+            for pos, (start, end) in enumerate(ranges):
+                expected = first_overlap(accepted, ranges, start, end)
+                self.assertEqual(index.find(start, end), expected, (ranges, pos))
+                # Dòng không chồng lấn vẫn có thể bị loại vì lý do khác (vd. Value dài hơn số bytes ghi)
+                if expected < 0 and rnd.random() < 0.9:
+                    index.add(pos)
+                    accepted.append(pos)
+
+class LoadPatchDataTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        # Overlap.xlsx được ghi vào thư mục hiện tại
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_overlap_pairs(self):
+        rnd = random.Random(2)
+        rows = []
+        for _ in range(80):
+            length = rnd.randint(1, 6)
+            value = " ".join(f"{rnd.randrange(256):02X}" for _ in range(rnd.randint(2, length + 1)))
+            rows.append([hex(rnd.randint(0, 120)), value, str(length)])
+        path = os.path.join(self.tmp.name, "patch_data.xlsx")
+        pd.DataFrame(rows, columns=["Offset", "Value", "Số bytes ghi"]).to_excel(path, index=False)
+
+        # Kết quả mong đợi theo cách gốc: bỏ nhóm trùng (offset, số byte), rồi so lần lượt với các khoảng đã ghi
+        groups = {}
+        for i, (offset, _, length) in enumerate(rows):
+            groups.setdefault((int(offset, 0), int(length)), []).append(i)
+        duplicated = {i for g in groups.values() if len(g) > 1 for i in g}
+        ranges = {}
+        accepted = []
+        expected_patches = []
+        expected_rows = []
+        for i, (offset, value, length) in enumerate(rows):
+            if i in duplicated:
+                continue
+            start, length = int(offset, 0), int(length)
+            ranges[i] = (start, start + length - 1)
+            gay = first_overlap(accepted, ranges, *ranges[i])
+            if gay >= 0:
+                expected_rows += [("Gây chồng lấn", str(gay + 2)), ("Bị chồng lấn", str(i + 2))]
+                continue
+            data = bytes.fromhex(value)
+            if len(data) > length:
+                expected_rows.append(("Value dài hơn số bytes ghi", str(i + 2)))
+                continue
+            expected_patches.append((start, data + b"\x00" * (length - len(data))))
+            accepted.append(i)
+
+        patch_list = load_patch_data_xlsx(path)
+        self.assertEqual(patch_list, expected_patches)
+        overlap = pd.read_excel("Overlap.xlsx", dtype=str)
+        got = [(kind, line) for kind, line in zip(overlap["Loại"], overlap["Dòng"])
+               if kind in ("Gây chồng lấn", "Bị chồng lấn", "Value dài hơn số bytes ghi")]
+        self.assertTrue(any(kind == "Gây chồng lấn" for kind, _ in expected_rows))
+        self.assertEqual(got, expected_rows)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# test_split.py
+
+# Kiểm tra ngẫu nhiên split_long_lines (chế độ đo theo ký tự) so với bản cài đặt gốc của libs.py,
+# và bộ tách dòng theo luồng (LineSplitter, thay thế + tách trong một lượt) so với split_long_lines.
+# Chạy: python -m pytest tests   hoặc   python -m unittest discover tests
+
+import os
+import re
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Module"))
+
+from libs import split_long_lines, LineSplitter
+from matcher import AhoCorasick
+from Functions import replacing_progress
+
+# Bản split_long_lines gốc (cắt lại từ đầu chuỗi sau mỗi lần tách), dùng làm chuẩn so sánh
+def legacy_split_long_lines(text, limit, append_vars=None):
+    if limit <= 0:
+        return text
+    append_vars = append_vars or []
+    append_str = ''.join(append_vars)
+    append_cost = len(append_vars)
+    forbidden_first = set(['.', ',', ';', '?', '!'])
+    result = []
+    for line in text.splitlines(keepends=True):
+        match = re.match(r'^(.*?)(\r\n|\n|\r)?$', line)
+        content, line_ending = match.group(1), match.group(2) or ''
+        if not content:
+            result.append(line_ending)
+            continue
+        current = content
+        if not append_str:
+            parts = []
+            while len(current) > limit:
+                split_pos = current.rfind(' ', 0, limit + 1)
+                if split_pos <= 0:
+                    split_pos = limit
+                part = current[:split_pos].rstrip()
+                rest = current[split_pos:].lstrip()
+                while rest and rest[0] in forbidden_first:
+                    part += rest[0]
+                    rest = rest[1:]
+                parts.append(part + '\n')
+                current = rest
+            parts.append(current + line_ending)
+            result.extend(parts)
+        else:
+            buffer = ""
+            while len(current) + append_cost > limit:
+                max_len = limit - append_cost
+                split_pos = current.rfind(' ', 0, max_len + 1)
+                if split_pos <= 0:
+                    split_pos = max_len
+                part = current[:split_pos].rstrip()
+                rest = current[split_pos:].lstrip()
+                while rest and rest[0] in forbidden_first:
+                    part += rest[0]
+                    rest = rest[1:]
+                buffer += part + append_str
+                current = rest
+            buffer += current + line_ending
+            result.append(buffer)
+    return ''.join(result)
+
+ALPHABET = "ab  .,;?!\t\x0b　\x85\r\n\r\nxyz  "
+APPEND_VARS = [None, [], [""], ["<v>"], ["A", "B"], ["", "x"], ["[1]", "[2]", "[3]"]]
+
+# Các bộ (văn bản, giới hạn, biến thêm) ngẫu nhiên; bỏ các bộ mà bản gốc không dừng (biến thêm chiếm hết giới hạn)
+def random_cases(seed, count, max_len=80):
+    rnd = random.Random(seed)
+    while count:
+        text = ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, max_len)))
+        limit = rnd.randint(-1, 15)
+        append_vars = rnd.choice(APPEND_VARS)
+        if append_vars and ''.join(append_vars) and len(append_vars) >= limit:
+            continue
+        count -= 1
+        yield rnd, text, limit, append_vars
+
+class SplitLongLinesTest(unittest.TestCase):
+    def test_matches_legacy(self):
+        for _, text, limit, append_vars in random_cases(1, 20000):
+            self.assertEqual(split_long_lines(text, limit, append_vars),
+                             legacy_split_long_lines(text, limit, append_vars), (text, limit, append_vars))
+
+    def test_long_lines(self):
+        line = ("lorem ipsum dolor sit amet, consectetur. " * 200)[:5000] + "\n"
+        for text in (line * 3, "x" * 5000 + "\n"):
+            for append_vars in (None, ["<v>"]):
+                self.assertEqual(split_long_lines(text, 80, append_vars), legacy_split_long_lines(text, 80, append_vars))
+
+class LineSplitterTest(unittest.TestCase):
+    # Cắt văn bản thành các đoạn ngẫu nhiên (kể cả rỗng), dòng vắt qua ranh giới đoạn vẫn phải tách như một lần
+    def test_chunked_feed_matches_split_long_lines(self):
+        for rnd, text, limit, append_vars in random_cases(2, 10000, 120):
+            splitter = LineSplitter(limit, append_vars)
+            out = []
+            pos = 0
+            while pos < len(text):
+                step = rnd.randint(0, 15)
+                out.append(splitter.feed(text[pos:pos + step]))
+                pos += step
+            out.append(splitter.flush())
+            self.assertEqual(''.join(out), split_long_lines(text, limit, append_vars), (text, limit, append_vars))
+
+    def test_replace_and_split_in_one_pass(self):
+        rnd = random.Random(3)
+        words = ["alpha", "beta", "gamma", "delta", "x", "yy", "."]
+        lines = []
+        for _ in range(30000):
+            lines.append(' '.join(rnd.choice(words) for _ in range(rnd.randint(0, 30))) + rnd.choice(["\n", "\r\n"]))
+        # Đủ dài để đi qua nhiều chunk của replacing_progress
+        text = ''.join(lines)
+        automaton = AhoCorasick({"alpha": "ALPHA ALPHA", "gamma": "", "yy": "y, y"})
+        for append_vars in (None, ["<v>"]):
+            got = replacing_progress(text, automaton, lambda percent: None, True, 40, append_vars)
+            self.assertEqual(got, split_long_lines(automaton.replace(text), 40, append_vars))
+
+if __name__ == "__main__":
+    unittest.main()